@@ -0,0 +1,230 @@
+"""Compact catalogue of the Telegram API methods, types and constructors
+
+resources/search.json is the JavaScript search index of the API docs, parsed into an AST.
+Running this module compiles the arrays the bot needs out of it into a small tab separated file:
+
+    python apicatalog.py [resources/search.json] [resources/api_catalog.tsv]
+
+Each category starts with a `<category>\t<count>` line, followed by `<name>\t<url suffix>` lines.
+"""
+import json
+import sys
+from array import array
+from collections import namedtuple
+from bisect import bisect_left, bisect_right
+from heapq import nsmallest
+from itertools import accumulate
+
+from util import TTLCache
+
+API_SOURCE = 'resources/search.json'
+API_CATALOG = 'resources/api_catalog.tsv'
+# Match sets of recent queries, the next keystroke only has to check the names the previous one matched
+MATCHES_CACHE_SIZE = 2048
+MATCHES_CACHE_TTL = 10 * 60
+MATCHES_CHECK_LIMIT = 128
+
+# Category shown to users, and the arrays of search.json holding its names and url suffixes
+CATEGORIES = (('Method', 'requests', 'requestsu'),
+              ('Type', 'types', 'typesu'),
+              ('Constructor', 'constructors', 'constructorsu'))
+
+ApiCategory = namedtuple('ApiCategory', 'names, lower_names, urls')
+_Table = namedtuple('_Table', 'by_rank, rank_of, bitsets, alphabetical, sorted_names, text, starts')
+
+
+def _find_arrays(node, arrays):
+    """Collects the `identifier = [...]` assignments of string literals in the AST"""
+    if isinstance(node, dict):
+        if (node.get('type') == 'AssignmentExpression' and node['left'].get('type') == 'Identifier'
+                and node['right'].get('type') == 'ArrayExpression'):
+            # The script falls back to empty arrays when loading fails, keep the populated ones
+            elements = node['right']['elements']
+            if len(elements) >= len(arrays.get(node['left']['name'], ())):
+                arrays[node['left']['name']] = [each['value'] for each in elements]
+        for value in node.values():
+            _find_arrays(value, arrays)
+    elif isinstance(node, list):
+        for value in node:
+            _find_arrays(value, arrays)
+    return arrays
+
+
+def compile_catalog(source=API_SOURCE, target=API_CATALOG):
+    with open(source, 'r') as file:
+        arrays = _find_arrays(json.load(file), {})
+
+    lines = []
+    for category, names_key, urls_key in CATEGORIES:
+        names, urls = arrays[names_key], arrays[urls_key]
+        if len(names) != len(urls):
+            raise ValueError(f'{names_key} and {urls_key} have different lengths in {source}')
+        lines.append(f'{category}\t{len(names)}')
+        lines.extend(f'{name}\t{url}' for name, url in zip(names, urls))
+
+    with open(target, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+
+def load_catalog(path=API_CATALOG):
+    """Maps each category to its names, lowercased names and url suffixes"""
+    with open(path, 'r') as file:
+        lines = file.read().splitlines()
+
+    catalog = {}
+    i = 0
+    while i < len(lines):
+        category, count = lines[i].split('\t')
+        rows = [line.split('\t') for line in lines[i + 1:i + 1 + int(count)]]
+        names = [name for name, _ in rows]
+        catalog[category] = ApiCategory(names, [name.lower() for name in names], [url for _, url in rows])
+        i += 1 + int(count)
+
+    return catalog
+
+
+def is_subsequence(needle, haystack):
+    rest = iter(haystack)
+    return all(char in rest for char in needle)
+
+
+class ApiIndex:
+    """Subsequence search over the catalogue
+
+    Names are ranked by length (then catalogue order) up front. Every letter, and every ordered pair of
+    letters, maps to a bitset over those ranks of the names containing it, so the candidates of a query
+    come from a few integer ANDs and are visited best ranked first, which lets a search stop as soon as it
+    has enough results. Match sets are cached, so a query extending a recent one narrows its matches
+    instead of starting over.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._tables = {}
+        self._matches = TTLCache(MATCHES_CACHE_SIZE, MATCHES_CACHE_TTL)
+        for category, value in catalog.items():
+            lower_names = value.lower_names
+            by_rank = array('I', sorted(range(len(lower_names)),
+                                        key=lambda position: (len(lower_names[position]), position)))
+            rank_of = array('I', [0]) * len(lower_names)
+            bitsets = {}
+            for rank, position in enumerate(by_rank):
+                rank_of[position] = rank
+                for key in self._keys(lower_names[position]):
+                    bitsets[key] = bitsets.get(key, 0) | (1 << rank)
+            # Alphabetical order, to find the names starting with the query by bisection
+            alphabetical = array('I', sorted(range(len(lower_names)), key=lambda position: lower_names[position]))
+            # All names in rank order on one line each, to find the ones containing the query with str.find
+            text = ''.join(lower_names[position] + '\n' for position in by_rank)
+            starts = array('I', [0]) + array('I', accumulate(len(lower_names[position]) + 1
+                                                             for position in by_rank[:-1]))
+            self._tables[category] = _Table(by_rank, rank_of, bitsets, alphabetical,
+                                            [lower_names[position] for position in alphabetical], text, starts)
+
+    @staticmethod
+    def _keys(name):
+        """Every letter of name, and every pair of letters appearing in that order"""
+        pairs = set()
+        letters = set()
+        for char in name:
+            pairs.update([letter + char for letter in letters])
+            letters.add(char)
+        return pairs | letters
+
+    @staticmethod
+    def normalize(query):
+        # Like the search of the API docs, only letters take part in the match
+        return ''.join(char for char in query.lower() if 'a' <= char <= 'z')
+
+    def candidates(self, category, needle):
+        """Bitset over the ranks of the names holding every consecutive pair of letters of needle in order"""
+        table = self._tables[category]
+        candidates = (1 << len(table.by_rank)) - 1
+        keys = {needle[i:i + 2] for i in range(len(needle) - 1)} or ({needle} if needle else ())
+        for key in keys:
+            candidates &= table.bitsets.get(key, 0)
+            if not candidates:
+                break
+        return candidates
+
+    def matches(self, category, needle):
+        """Bitset over the ranks of the names that may contain needle as a subsequence, and whether all do"""
+        # Up to two letters, the letter and pair bitsets are exact already
+        if len(needle) <= 2:
+            return self.candidates(category, needle), True
+
+        cached = self._matches.get((category, needle))
+        if cached is not None:
+            return cached, True
+
+        # Names matching a query also match any shorter query it starts with
+        candidates = self.candidates(category, needle)
+        for end in range(len(needle) - 1, 2, -1):
+            narrowed = self._matches.get((category, needle[:end]))
+            if narrowed is not None:
+                candidates &= narrowed
+                break
+
+        # Checking every candidate only pays off when there are few, otherwise the search stops early instead
+        if bin(candidates).count('1') > MATCHES_CHECK_LIMIT:
+            return candidates, False
+
+        by_rank = self._tables[category].by_rank
+        lower_names = self.catalog[category].lower_names
+        matches = 0
+        while candidates:
+            lowest = candidates & -candidates
+            candidates ^= lowest
+            if is_subsequence(needle, lower_names[by_rank[lowest.bit_length() - 1]]):
+                matches |= lowest
+
+        self._matches.set((category, needle), matches)
+        return matches, True
+
+    def search_category(self, category, needle, amount=10):
+        """Positions of the best `amount` names containing needle as a subsequence
+
+        Names starting with needle come first, then those containing it in one piece, then the rest,
+        each group shortest name first.
+        """
+        lower_names = self.catalog[category].lower_names
+        by_rank, rank_of, _, alphabetical, sorted_names, text, starts = self._tables[category]
+
+        first = bisect_left(sorted_names, needle)
+        last = bisect_left(sorted_names, needle + '\U0010ffff', first)
+        found = [by_rank[rank] for rank in nsmallest(amount, (rank_of[position]
+                                                              for position in alphabetical[first:last]))]
+
+        offset = text.find(needle) if len(found) < amount else -1
+        while offset != -1:
+            rank = bisect_right(starts, offset) - 1
+            position = by_rank[rank]
+            if not lower_names[position].startswith(needle):
+                found.append(position)
+                if len(found) == amount:
+                    return found
+            offset = text.find(needle, starts[rank + 1]) if rank + 1 < len(starts) else -1
+
+        # Only the names holding needle in pieces are left, visited shortest first
+        matches, exact = self.matches(category, needle)
+        while matches and len(found) < amount:
+            lowest = matches & -matches
+            matches ^= lowest
+            position = by_rank[lowest.bit_length() - 1]
+            name = lower_names[position]
+            if needle not in name and (exact or is_subsequence(needle, name)):
+                found.append(position)
+        return found
+
+    def search(self, query, amount=10):
+        """The best `amount` (category, name, url suffix) matches of every category"""
+        needle = self.normalize(query)
+        results = []
+        for category, value in self.catalog.items():
+            for position in self.search_category(category, needle, amount):
+                results.append((category, value.names[position], value.urls[position]))
+        return results
+
+
+if __name__ == '__main__':
+    compile_catalog(*sys.argv[1:3])
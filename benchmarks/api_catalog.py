@@ -0,0 +1,47 @@
+"""Compare loading the compiled API catalogue with loading the full search.json AST
+
+Run from the repository root:
+
+    python -m benchmarks.api_catalog
+"""
+import json
+import time
+import tracemalloc
+
+from apicatalog import API_CATALOG, API_SOURCE, load_catalog
+
+ROUNDS = 20
+
+
+def load_ast():
+    """What main() used to do at startup"""
+    with open(API_SOURCE, 'r') as file:
+        main_list = json.load(file)
+    body = main_list['body'][13]['block']['body']
+    lists = [[each['value'] for each in body[i]['expression']['right']['elements']] for i in range(6)]
+    return {"Method": (lists[0], lists[3]), "Type": (lists[1], lists[4]), "Constructor": (lists[2], lists[5])}
+
+
+def measure(loader):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        loader()
+    elapsed = (time.perf_counter() - start) / ROUNDS
+
+    tracemalloc.start()
+    result = loader()
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return elapsed, peak, retained
+
+
+def main():
+    print(f'{"loader":<18}{"ms":>9}{"peak KiB":>11}{"kept KiB":>11}')
+    for name, loader in (('search.json AST', load_ast), (API_CATALOG.split('/')[-1], load_catalog)):
+        elapsed, peak, retained = measure(loader)
+        print(f'{name:<18}{elapsed * 1000:>9.2f}{peak / 1024:>11.0f}{retained / 1024:>11.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Compare github.find_references with the regex the github handler used before
+
+Run from the repository root:
+
+    python -m benchmarks.github_references [fuzz rounds]
+
+First both are run over random messages made of reference-like pieces and every difference is listed,
+then both are timed on growing adversarial messages. The old regex is no longer timed once a single
+message takes longer than OLD_BUDGET seconds.
+"""
+import random
+import re
+import sys
+import time
+
+from github import find_references
+
+OLD_PATTERN = re.compile(r'''
+    (?i)                                # Case insensitivity
+    [\s\S]*?                            # Any characters
+    (?:                                 # Optional non-capture group for username/repo
+        (?P<user>[^\s/\#@]+)            # Matches username (any char but whitespace, slash, hashtag and at)
+        (?:/(?P<repo>[^\s/\#@]+))?      # Optionally matches repo, with a slash in front
+    )?                                  # End optional non-capture group
+    (?:                                 # Match either
+        (
+            (?P<number_type>\#|GH-|PR-) # Hashtag or "GH-" or "PR-"
+            (?P<number>\d*)             # followed by numbers
+        )
+    |                                   # Or
+        (?:@?(?P<sha>[0-9a-f]{40}))     # at sign followed by 40 hexadecimal characters
+    )
+''', re.VERBOSE)
+
+OLD_BUDGET = 0.5
+SHA = '5a4e0d3c2b1f9e8d7c6b5a4e0d3c2b1f9e8d7c6b'
+PIECES = ('#', '#12', 'GH-', 'gh-3', 'PR-45', 'pr-', '@', SHA, SHA[:7], '/', 'lonami', 'Telethon', 'issue',
+          'ab', '12', 'ünï', ' ', ' ', ' ', '\n', '-', '.', '"')
+TRACEBACK_LINE = 'File "/usr/lib/python3.6/site-packages/telethon/network/mtprotosender.py", line 120, in _connect\n'
+ADVERSARIAL = (
+    ('no spaces', 'x'),
+    ('slashes', 'ab/'),
+    ('hex run', 'f'),
+    ('hashes', '#a'),
+    ('GH- in words', 'gh-x'),
+    ('traceback', TRACEBACK_LINE),
+)
+
+
+def old_references(text):
+    """What the github handler did with the old regex, minus the matches it crashed on"""
+    return [(match.group('user'), match.group('repo'), match.group('number'), match.group('sha'))
+            for match in OLD_PATTERN.finditer(text) if match.group('number') or match.group('sha')]
+
+
+def fuzz(rounds):
+    rng = random.Random(0)
+    differences = 0
+    for _ in range(rounds):
+        text = ''.join(rng.choice(PIECES) for _ in range(rng.randint(1, 12)))
+        old, new = old_references(text), [tuple(reference) for reference in find_references(text)]
+        if old != new:
+            differences += 1
+            print(f'{text!r}\n  old {old}\n  new {new}')
+    print(f'{differences} of {rounds} random messages differ\n')
+
+
+def timed(function, text):
+    start = time.perf_counter()
+    function(text)
+    return time.perf_counter() - start
+
+
+def main():
+    fuzz(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
+
+    print(f'{"message":<14}{"chars":>8}{"old ms":>12}{"new ms":>10}')
+    for name, piece in ADVERSARIAL:
+        old_done = False
+        for size in (128, 512, 1024, 4096, 16384, 65536):
+            text = piece * (size // len(piece) or 1)
+            old = '-'
+            if not old_done:
+                seconds = timed(old_references, text)
+                old = f'{seconds * 1000:.1f}'
+                old_done = seconds > OLD_BUDGET
+            print(f'{name:<14}{len(text):>8}{old:>12}{timed(find_references, text) * 1000:>10.2f}')
+
+
+if __name__ == '__main__':
+    main()
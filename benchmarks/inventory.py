@@ -0,0 +1,168 @@
+"""Check inventory.read_inventory against Sphinx, and compare what reading an inventory costs with either
+
+Run from the repository root, with Sphinx installed next to the requirements:
+
+    python -m benchmarks.inventory [objects.inv]
+
+Both read a fixture full of corner cases, fed a few bytes at a time, and the inventory the bot cached (or the
+given one, or a synthetic one), and every difference is listed. Then the import, the reading, and a fresh
+interpreter doing both are timed, with the memory they take.
+"""
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import zlib
+from io import BytesIO
+
+from inventory import read_inventory
+from search import DOCS_URL, INVENTORY_CACHE
+
+ROUNDS = 5
+FIXTURE_LINES = (
+    'telethon py:module 0 telethon.html#module-$ -',
+    # Old Sphinx versions listed modules twice, the first one counts
+    'telethon py:module 0 wrong.html#module-telethon -',
+    'telethon.client.TelegramClient py:class 1 telethon.client.html#$ -',
+    'telethon.client.TelegramClient.connect py:method 1 telethon.client.html#$ TelegramClient.connect()',
+    'telethon.errors.RPCError py:exception -1 telethon.errors.html#telethon.errors.RPCError -',
+    'telethon.tl.types py:module 0 telethon.tl.html#module-telethon.tl.types -',
+    # Listed again, the later location counts
+    'telethon.tl.types.Message py:class 1 a.html#$ -',
+    'telethon.tl.types.Message py:class 1 b.html#$ -',
+    'a label with spaces std:label -1 intro.html#label Label with spaces',
+    'Another Label std:label -1 intro.html#another Another label',
+    'another label std:label -1 intro.html#another Another label',
+    'index std:doc -1 index.html Index',
+    'ünïcödé py:data 1 unicode.html#$ -',
+    'no type here 1 nothing.html -',
+    'telethon.sync py:module 0 telethon.sync.html -\r',
+    'trailing.spaces py:function 1 spaces.html#$ -   ',
+    '',
+    'telethon.helpers.strip_text py:function 1 telethon.helpers.html#$ strip_text(text, entities)',
+)
+
+
+class TrickleFile(BytesIO):
+    """Hands out at most 7 bytes per read, so lines and the compressed data are split everywhere"""
+
+    def read(self, size=-1):
+        return super().read(7 if size < 0 else min(size, 7))
+
+
+def fixture():
+    body = '\n'.join(FIXTURE_LINES).encode()
+    return (b'# Sphinx inventory version 2\n# Project: Telethon\n# Version: 1.0\n'
+            b'# The remainder of this file is compressed using zlib.\n' + zlib.compress(body))
+
+
+def inventory_bytes():
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    elif os.path.exists(INVENTORY_CACHE):
+        path = INVENTORY_CACHE
+    else:
+        from benchmarks.replay import synthetic_inventory
+        return synthetic_inventory()
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def with_ours(data, file_type=BytesIO):
+    """(type, name) to (url, display name), keeping the last of entries listed twice like Sphinx does"""
+    return {(entry.type, entry.name): (entry.url, entry.display_name)
+            for entry in read_inventory(file_type(data), DOCS_URL)}
+
+
+def with_sphinx(data):
+    from sphinx.util.inventory import InventoryFile
+    result = {}
+    for typ, items in InventoryFile.load(BytesIO(data), DOCS_URL, None).items():
+        for name, item in items.items():
+            result[typ, name] = (item.uri, name if item.display_name == '-' else item.display_name)
+    return result
+
+
+def load_ours(data):
+    return list(read_inventory(BytesIO(data), DOCS_URL))
+
+
+def load_sphinx(data):
+    from sphinx.util.inventory import InventoryFile
+    return InventoryFile.load(BytesIO(data), DOCS_URL, None)
+
+
+def compare(label, data):
+    expected = with_sphinx(data)
+    for file_type in (BytesIO, TrickleFile):
+        found = with_ours(data, file_type)
+        differences = [(key, expected.get(key), found.get(key)) for key in expected.keys() | found.keys()
+                       if expected.get(key) != found.get(key)]
+        for key, sphinx_value, our_value in differences:
+            print(f'  {key}\n    sphinx {sphinx_value}\n    ours   {our_value}')
+        print(f'{label}, {file_type.__name__}: {len(found)} entries, {len(differences)} differ from Sphinx')
+
+
+def timed(function):
+    best = float('inf')
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def peak(function):
+    tracemalloc.start()
+    function()
+    size = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return size
+
+
+def fresh(code):
+    """Seconds and peak resident KiB of a fresh interpreter running code"""
+    # The peak in /proc starts over with the new program, the one getrusage tells counts the forked parent in too
+    script = ('import time\nstart = time.perf_counter()\n' + code + '\nseconds = time.perf_counter() - start\n'
+              'status = open("/proc/self/status").read()\n'
+              'print(seconds, status.split("VmHWM:")[1].split()[0])')
+    output = subprocess.run([sys.executable, '-W', 'ignore', '-c', script], check=True, capture_output=True,
+                            text=True, cwd=os.getcwd()).stdout.split()
+    return float(output[-2]), int(output[-1])
+
+
+def main():
+    data = inventory_bytes()
+    try:
+        import sphinx.util.inventory  # noqa: F401
+    except ImportError:
+        sys.exit('Sphinx is needed to compare with, pip install Sphinx')
+
+    compare('Fixture', fixture())
+    compare('Inventory', data)
+
+    path = os.path.abspath(sys.argv[1] if len(sys.argv) > 1 else INVENTORY_CACHE)
+    source = f'open({path!r}, "rb")' if os.path.exists(path) else f'__import__("io").BytesIO({data!r})'
+    sphinx_code = ('from sphinx.util.inventory import InventoryFile\n'
+                   f'InventoryFile.load({source}, {DOCS_URL!r}, None)')
+    our_code = f'from inventory import read_inventory\nlist(read_inventory({source}, {DOCS_URL!r}))'
+
+    print(f'\n{"":<24}{"sphinx":>12}{"ours":>12}')
+    sphinx_import, _ = fresh('import sphinx.util.inventory')
+    our_import, _ = fresh('import inventory')
+    print(f'{"import ms":<24}{sphinx_import * 1000:>12.1f}{our_import * 1000:>12.1f}')
+    sphinx_read = timed(lambda: load_sphinx(data))
+    our_read = timed(lambda: load_ours(data))
+    print(f'{"read ms":<24}{sphinx_read * 1000:>12.1f}{our_read * 1000:>12.1f}')
+    sphinx_peak = peak(lambda: load_sphinx(data))
+    our_peak = peak(lambda: load_ours(data))
+    print(f'{"read peak KiB":<24}{sphinx_peak / 1024:>12.0f}{our_peak / 1024:>12.0f}')
+    sphinx_seconds, sphinx_rss = fresh(sphinx_code)
+    our_seconds, our_rss = fresh(our_code)
+    print(f'{"fresh start ms":<24}{sphinx_seconds * 1000:>12.1f}{our_seconds * 1000:>12.1f}')
+    print(f'{"fresh start RSS KiB":<24}{sphinx_rss:>12}{our_rss:>12}')
+
+
+if __name__ == '__main__':
+    main()
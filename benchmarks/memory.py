@@ -0,0 +1,92 @@
+"""Memory held by the documentation index and the API tables
+
+Run from the repository root:
+
+    python -m benchmarks.memory [objects.inv]
+
+Without an inventory the one the bot cached is used, or a synthetic one if there is none. Printed are the
+bytes every structure holds, traced with tracemalloc while it is read and built, and where they go.
+"""
+import gc
+import os
+import sys
+import tracemalloc
+from array import array
+from io import BytesIO
+
+from apicatalog import ApiIndex, load_catalog
+from docsindex import DocsIndex, StringTable
+from inventory import read_inventory
+from search import DOCS_URL, INVENTORY_CACHE
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def deep_size(value, seen=None):
+    """Bytes of value and everything it refers to, counting shared objects once"""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(each, seen) for key, each in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(each, seen) for each in value)
+    elif isinstance(value, StringTable) or hasattr(value, '_fields'):
+        size += deep_size(vars(value) if isinstance(value, StringTable) else tuple(value), seen)
+    elif numpy is not None and isinstance(value, numpy.ndarray):
+        size = value.nbytes
+    elif isinstance(value, (str, bytes, int, float, array)):
+        pass
+    elif hasattr(value, '__dict__'):
+        size += deep_size(vars(value), seen)
+    return size
+
+
+def traced(build):
+    """What build() returns, and the bytes it still holds once built"""
+    gc.collect()
+    tracemalloc.start()
+    value = build()
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return value, size
+
+
+def inventory_bytes():
+    if len(sys.argv) > 1:
+        path = sys.argv[1]
+    elif os.path.exists(INVENTORY_CACHE):
+        path = INVENTORY_CACHE
+    else:
+        from benchmarks.replay import synthetic_inventory
+        print('No cached inventory, using a synthetic one\n')
+        return synthetic_inventory()
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def main():
+    data = inventory_bytes()
+    index, index_size = traced(lambda: DocsIndex(read_inventory(BytesIO(data), DOCS_URL)))
+    catalog, catalog_size = traced(load_catalog)
+    api_index, api_index_size = traced(lambda: ApiIndex(catalog))
+
+    print(f'{"structure":<24}{"KiB":>10}')
+    print(f'{f"DocsIndex ({len(index)})":<24}{index_size / 1024:>10.0f}')
+    seen = set()
+    for name, value in sorted(vars(index).items()):
+        if name != 'results':
+            print(f'{"  " + name:<24}{deep_size(value, seen) / 1024:>10.0f}')
+    print(f'{"API catalog":<24}{catalog_size / 1024:>10.0f}')
+    print(f'{"ApiIndex":<24}{api_index_size / 1024:>10.0f}')
+    print(f'\n{(index_size + catalog_size + api_index_size) / 1024 / 1024:.1f} MiB in all')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,401 @@
+"""Replay group messages, edits and inline queries through the bot's handlers and report their latencies
+
+Run from the repository root:
+
+    python -m benchmarks.replay [--corpus updates.jsonl] [--inventory objects.inv] [--rounds 3]
+                                [--cold] [--github-latency 0] [--save results.json] [--compare results.json]
+
+The handlers run as they do in the bot, minus run_async, against a fake Bot that answers right away and
+local stand-ins for GitHub and readthedocs. Without --corpus a synthetic one is made, a recorded corpus
+is a file of Update JSON objects, one per line. Without --inventory a synthetic one is served.
+
+Every handler gets its p50/p95/p99 latency, throughput, and the memory a call allocates at its peak,
+measured on a separate pass with tracemalloc on. --save writes these out, --compare prints the change
+against saved ones and exits with 1 when a percentile got more than --tolerance slower.
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import zlib
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from telegram import Chat, Message, Update
+
+from components import inlinequeries, taghints
+import rules_bot
+import github
+import search as search_module
+from apicatalog import ApiIndex, load_catalog
+from router import Router
+from search import search
+
+CORPUS_SIZE = 2000
+PERCENTILES = (50, 95, 99)
+TOLERANCE = 0.10
+
+GROUP = {'id': -1001, 'type': 'supergroup', 'username': rules_bot.ONTOPIC_USERNAME}
+OFFTOPIC_GROUP = {'id': -1002, 'type': 'supergroup', 'username': rules_bot.OFFTOPIC_USERNAME}
+
+WORDS = ('Input', 'Peer', 'User', 'Message', 'Media', 'Photo', 'Document', 'Channel', 'Chat', 'Update', 'Send',
+         'Get', 'Request', 'Flood', 'Wait', 'Bot', 'Inline', 'Query', 'Result', 'Callback', 'Button', 'File',
+         'Location', 'Poll', 'Sticker', 'Dialog', 'Participant', 'Admin', 'Rights', 'Reply', 'Markup', 'Entity',
+         'Full', 'Empty', 'Forward', 'Edit', 'Delete', 'Pinned', 'Draft', 'Game', 'Invoice', 'Contact', 'Venue')
+MODULES = ('telethon', 'telethon.client', 'telethon.client.messages', 'telethon.client.chats',
+           'telethon.client.uploads', 'telethon.events', 'telethon.errors', 'telethon.errors.rpcerrorlist',
+           'telethon.tl.custom', 'telethon.tl.custom.message', 'telethon.tl.types', 'telethon.tl.types.messages',
+           'telethon.tl.functions.messages', 'telethon.tl.functions.channels', 'telethon.network', 'telethon.utils')
+CHATTER = ('hi all', 'how do I download media from a channel?', 'thanks, that worked',
+           'I get a FloodWaitError when sending too many messages', 'which version are you using',
+           'lol', 'anyone here?', 'read the docs please', 'Traceback (most recent call last):\n  File "main.py", '
+           'line 12, in <module>\n    client.start()\nConnectionError: Cannot send requests while disconnected')
+
+
+def synthetic_inventory(seed=0, classes=1500):
+    """objects.inv bytes with Telethon-like modules, classes, methods and attributes"""
+    rng = random.Random(seed)
+    lines = [f'{module} py:module 0 {module.replace(".", "/")}.html#module-$ -' for module in MODULES]
+    for _ in range(classes):
+        module = rng.choice(MODULES)
+        name = ''.join(rng.sample(WORDS, rng.randint(1, 3)))
+        kind = 'py:exception' if module.startswith('telethon.errors') else 'py:class'
+        page = module.replace('.', '/') + '.html'
+        lines.append(f'{module}.{name}{"Error" if kind == "py:exception" else ""} {kind} 1 {page}#$ -')
+        for _ in range(rng.randint(2, 12)):
+            member = '_'.join(word.lower() for word in rng.sample(WORDS, rng.randint(1, 3)))
+            typ = rng.choice(('py:method', 'py:attribute'))
+            lines.append(f'{module}.{name}.{member} {typ} 1 {page}#$ -')
+
+    header = b'# Sphinx inventory version 2\n# Project: Telethon\n# Version: 1.0\n' \
+             b'# The remainder of this file is compressed using zlib.\n'
+    return header + zlib.compress('\n'.join(lines).encode() + b'\n')
+
+
+def synthetic_corpus(names, size=CORPUS_SIZE, seed=0):
+    """Update dicts of group chatter, references, edits, topic moves, hints and inline typing"""
+    rng = random.Random(seed)
+    updates = []
+    sent = []
+
+    def message(text, chat=GROUP, reply=False):
+        data = {'message_id': len(updates) + 1, 'date': 0, 'chat': chat, 'text': text,
+                'from': {'id': rng.randint(1, 50), 'is_bot': False, 'first_name': 'Member', 'username': 'member'}}
+        if reply and sent:
+            data['reply_to_message'] = rng.choice(sent)
+        return data
+
+    while len(updates) < size:
+        kind = rng.random()
+        name = rng.choice(names)
+        short = name.rsplit('.', 1)[-1]
+        if kind < 0.35:
+            text = rng.choice(CHATTER)
+            updates.append({'message': message(text)})
+        elif kind < 0.55:
+            refs = [rng.choice((f'#{rng.randint(1, 1500)}', f'GH-{rng.randint(1, 1500)}',
+                                f'LonamiWebs/Telethon#{rng.randint(1, 1500)}',
+                                f'{rng.getrandbits(160):040x}')) for _ in range(rng.randint(1, 3))]
+            data = message(f'{rng.choice(CHATTER)} see {" and ".join(refs)}')
+            updates.append({'message': data})
+            sent.append(data)
+        elif kind < 0.62 and sent:
+            data = dict(rng.choice(sent))
+            data['text'] += rng.choice((' (edited)', f' also #{rng.randint(1, 1500)}'))
+            data['edit_date'] = 1
+            updates.append({'edited_message': data})
+        elif kind < 0.67:
+            if rng.random() < 0.7:
+                updates.append({'message': message(rng.choice(('this is off topic', 'go offtopic pls')), reply=True)})
+            else:
+                updates.append({'message': message('back on topic, how do I log in?', chat=OFFTOPIC_GROUP)})
+        elif kind < 0.72:
+            updates.append({'message': message(f'{rng.choice(list(taghints.HINTS))} {short}', reply=True)})
+        else:
+            # Someone typing a query, one update per keystroke
+            query = rng.choice((short, short.lower(), f'+{short}+ is what you want', name))
+            user = {'id': rng.randint(1, 50), 'is_bot': False, 'first_name': 'Member'}
+            for end in range(1, len(query) + 1, rng.choice((1, 2))):
+                updates.append({'inline_query': {'id': str(len(updates)), 'from': user, 'query': query[:end],
+                                                 'offset': ''}})
+            if rng.random() < 0.3:
+                # and scrolling down to the next page
+                updates.append({'inline_query': {'id': str(len(updates)), 'from': user, 'query': query,
+                                                 'offset': str(inlinequeries.PAGE_SIZE)}})
+    for update_id, update in enumerate(updates[:size]):
+        update['update_id'] = update_id
+    return updates[:size]
+
+
+class FakeBot:
+    """Answers every Bot API call right away, serializing what it would have sent like the real one"""
+
+    def __init__(self):
+        self.calls = 0
+        self._message_id = 10 ** 6
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self._lock:
+            self.calls += 1
+            self._message_id += 1
+            message_id = self._message_id
+        reply_markup = kwargs.get('reply_markup')
+        if reply_markup:
+            reply_markup.to_json()
+        # Messages may go to a chat by its @username
+        chat = Chat(chat_id if isinstance(chat_id, int) else 0, 'supergroup')
+        return Message(message_id, None, datetime.now(), chat, text=text, bot=self)
+
+    sendMessage = send_message
+
+    def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        self.calls += 1
+        return Message(message_id, None, datetime.now(), Chat(chat_id, 'supergroup'), text=text, bot=self)
+
+    def answer_inline_query(self, inline_query_id, results, **kwargs):
+        self.calls += 1
+        json.dumps([result.to_dict() for result in results])
+        return True
+
+    answerInlineQuery = answer_inline_query
+
+    def send_chat_action(self, chat_id, action, **kwargs):
+        self.calls += 1
+        return True
+
+    def delete_message(self, chat_id, message_id, **kwargs):
+        self.calls += 1
+        return True
+
+
+class StandIn(BaseHTTPRequestHandler):
+    """GitHub issue, pull request and commit pages, and the documentation inventory"""
+    protocol_version = 'HTTP/1.1'
+    inventory = b''
+    latency = 0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        parts = self.path.strip('/').split('/')
+        if self.path.endswith('/objects.inv'):
+            return self._send(200, self.inventory, 'application/octet-stream')
+        if len(parts) == 4 and parts[2] in ('issues', 'pull', 'commit'):
+            kind = {'issues': 'Issue', 'pull': 'Pull Request', 'commit': 'Commit'}[parts[2]]
+            if parts[3].isdigit() and int(parts[3]) % 10 == 0:
+                return self._send(404, b'Not Found', 'text/plain')
+            title = f'Thing number {parts[3][:7]} · {kind} #{parts[3][:7]} · {parts[0]}/{parts[1]} · GitHub'
+            body = f'<html><head><title>{title}</title></head><body>{"x" * 20000}</body></html>'.encode()
+            return self._send(200, body, 'text/html; charset=utf-8')
+        self._send(404, b'Not Found', 'text/plain')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # The bot hangs up on GitHub pages once it has their title
+        pass
+
+
+# The routes the bot adds to its router, see rules_bot.main
+ROUTER = Router()
+taghints.add_routes(ROUTER)
+rules_bot.add_routes(ROUTER)
+
+
+def route(update):
+    """The handler calls the dispatcher would make for update, as (name, function, args)"""
+    if update.inline_query:
+        inline = update.inline_query
+        inlinequeries.latest_queries.received(inline)
+        calls = [('inline_query', inlinequeries.inline_query.__wrapped__, ())]
+        # Also on its own, the inline query handler calls it for these
+        if inline.query.count(rules_bot.ENCLOSING_REPLACEMENT_CHARACTER) > 1:
+            calls.append(('fuzzy_replacements_markdown', None, ()))
+        return calls
+
+    # Finding the routes is measured on its own, as "router"
+    calls = [('router', None, ())]
+    for each, groups in ROUTER.matches(update.effective_message.text or '', edited=bool(update.edited_message)):
+        extra = ('chat_data',) if each.pass_chat_data else (groups,) if each.pass_groups else ()
+        calls.append((each.callback.__name__, getattr(each.callback, '__wrapped__', each.callback), extra))
+        if each.stop:
+            break
+    return calls
+
+
+def replay(updates, bot, api_index, cold, allocations):
+    """Runs updates through their handlers, returns seconds taken (or bytes allocated) by handler name"""
+    measured = {}
+    chat_data = {}
+    for data in updates:
+        update = Update.de_json(data, bot)
+        for name, handler, extra in route(update):
+            if cold:
+                clear_caches()
+            if allocations:
+                tracemalloc.reset_peak()
+                before = tracemalloc.get_traced_memory()[0]
+            start = time.perf_counter()
+
+            if name == 'inline_query':
+                handler(bot, update, api_index)
+            elif name == 'router':
+                ROUTER.matches(update.effective_message.text or '', edited=bool(update.edited_message))
+            elif name == 'fuzzy_replacements_markdown':
+                rules_bot.fuzzy_replacements_markdown(update.inline_query.query)
+            elif extra == ('chat_data',):
+                handler(bot, update, chat_data.setdefault(update.effective_chat.id, {}))
+            else:
+                handler(bot, update, *extra)
+
+            if allocations:
+                value = tracemalloc.get_traced_memory()[1] - before
+            else:
+                value = time.perf_counter() - start
+            measured.setdefault(name, []).append(value)
+    return measured
+
+
+def clear_caches():
+    if search._index:
+        search._index.results.clear()
+    inlinequeries.results_cache.clear()
+    github.references._cache.clear()
+
+
+def percentile(values, p):
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+def summarize(latencies, allocations):
+    results = {}
+    for name, values in latencies.items():
+        values = sorted(values)
+        allocated = sorted(allocations.get(name, [0]))
+        results[name] = {
+            'calls': len(values),
+            **{f'p{p}_ms': percentile(values, p) * 1000 for p in PERCENTILES},
+            'per_second': len(values) / sum(values),
+            'alloc_kib': percentile(allocated, 50) / 1024,
+        }
+    return results
+
+
+def report(results, baseline=None, tolerance=TOLERANCE):
+    """Prints results, next to baseline if given, and returns whether any percentile regressed"""
+    columns = [f'p{p}_ms' for p in PERCENTILES] + ['per_second', 'alloc_kib']
+    width = 20 if baseline else 12
+    print(f'{"handler":<30}{"calls":>7}' + ''.join(f'{column:>{width}}' for column in columns))
+    regressed = False
+    for name, result in sorted(results.items()):
+        row = f'{name:<30}{result["calls"]:>7}'
+        for column in columns:
+            cell = f'{result[column]:.3f}' if column.endswith('ms') else f'{result[column]:.0f}'
+            old = (baseline or {}).get(name, {}).get(column)
+            if old:
+                change = result[column] / old - 1
+                cell += f' {change:+.0%}'
+                if column.endswith('ms') and change > tolerance:
+                    regressed = True
+                    cell += '!'
+            row += f'{cell:>{width}}'
+        print(row)
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--corpus', help='file of Update JSON objects, one per line')
+    parser.add_argument('--inventory', help='objects.inv to serve instead of a synthetic one')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--cold', action='store_true', help='clear all caches before every handler call')
+    parser.add_argument('--github-latency', type=float, default=0, help='milliseconds the stand-in waits')
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare', help='results saved earlier to compare with')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    if args.inventory:
+        with open(args.inventory, 'rb') as file:
+            StandIn.inventory = file.read()
+    else:
+        StandIn.inventory = synthetic_inventory()
+    StandIn.latency = args.github_latency / 1000
+    server = StandInServer(('127.0.0.1', 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}/'
+    rules_bot.GITHUB_URL = base_url
+
+    # Loaded through the same conditional download the bot does, cached aside from the bot's own cache
+    search_module.DOCS_URL = base_url + 'docs/'
+    search._cache_path = os.path.join(tempfile.mkdtemp(), 'objects.inv')
+    search._validators = {}
+    start = time.perf_counter()
+    search.parse_docs()
+    print(f'inventory of {len(search._index)} entries loaded in {time.perf_counter() - start:.2f} s')
+
+    if args.corpus:
+        with open(args.corpus) as file:
+            updates = [json.loads(line) for line in file if line.strip()]
+    else:
+        updates = synthetic_corpus(search._index.names)
+    print(f'{len(updates)} updates, {args.rounds} rounds{", cold" if args.cold else ""}\n')
+
+    bot = FakeBot()
+    api_index = ApiIndex(load_catalog())
+    clear_caches()
+    latencies = {}
+    start = time.perf_counter()
+    for _ in range(args.rounds):
+        for name, values in replay(updates, bot, api_index, args.cold, False).items():
+            latencies.setdefault(name, []).extend(values)
+    elapsed = time.perf_counter() - start
+
+    clear_caches()
+    tracemalloc.start()
+    allocations = replay(updates, bot, api_index, args.cold, True)
+    tracemalloc.stop()
+
+    results = summarize(latencies, allocations)
+    settings = {'corpus': args.corpus, 'inventory': args.inventory, 'updates': len(updates), 'rounds': args.rounds,
+                'cold': args.cold, 'github_latency': args.github_latency}
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            saved = json.load(file)
+        if saved['settings'] != settings:
+            print(f'Compared results were run with other settings: {saved["settings"]}\n')
+        baseline = saved['handlers']
+    regressed = report(results, baseline, args.tolerance)
+    print(f'\n{len(updates) * args.rounds / elapsed:.0f} updates/s overall, {bot.calls} Bot API calls')
+
+    if args.save:
+        with open(args.save, 'w') as file:
+            json.dump({'settings': settings, 'handlers': results}, file, indent=2)
+    server.shutdown()
+    github.executor.shutdown(wait=False)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Compare the full inventory scan of Search.docs with the trigram indexed path
+
+Run from the repository root:
+
+    python -m benchmarks.search_docs [path/to/objects.inv]
+
+Without a path the cached inventory is used, downloading it first if it changed.
+"""
+import sys
+import time
+
+from search import search
+
+QUERIES = ['TelegramClient', 'NewMessage', 'send_message', 'events.NewMessage', 'get_entity', 'Telegrm',
+           'client.download_media', 'iter_messages', 'InputPeerUser', 'sendmessage', 'Button.inline', 'errors',
+           'FloodWaitError', 'start', 'tl.custom.Message', 'edit_message', 'conversation', 'CallbackQuery']
+THRESHOLDS = (20, 80, 95)
+ROUNDS = 5
+
+
+def timed(query, threshold, exhaustive):
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        search._index.results.clear()
+        result = search.docs(query, threshold=threshold, exhaustive=exhaustive)
+    return (time.perf_counter() - start) / ROUNDS, result
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as file:
+            search.load_docs(file)
+    else:
+        try:
+            search.parse_docs()
+        except Exception as e:
+            print(f'Could not revalidate the inventory ({e!r}), using the cached one')
+        if not len(search._index):
+            sys.exit('No cached documentation inventory, pass the path to an objects.inv')
+
+    print(f'{len(search._index)} inventory entries, {ROUNDS} rounds per query\n')
+    print(f'{"query":<24}{"thr":>4}{"scan ms":>10}{"index ms":>10}{"speedup":>9}  same top  same list')
+
+    totals = [0, 0]
+    same_top = same_list = 0
+    for query in QUERIES:
+        for threshold in THRESHOLDS:
+            scan_time, scan = timed(query, threshold, True)
+            index_time, indexed = timed(query, threshold, False)
+            totals[0] += scan_time
+            totals[1] += index_time
+            top = (scan or [None])[0] == (indexed or [None])[0]
+            same_top += top
+            same_list += scan == indexed
+            print(f'{query:<24}{threshold:>4}{scan_time * 1000:>10.2f}{index_time * 1000:>10.2f}'
+                  f'{scan_time / index_time:>8.1f}x  {str(top):<9} {scan == indexed}')
+
+    runs = len(QUERIES) * len(THRESHOLDS)
+    print(f'\ntotal: scan {totals[0] * 1000:.1f} ms, index {totals[1] * 1000:.1f} ms '
+          f'({totals[0] / totals[1]:.1f}x), same top result {same_top}/{runs}, same list {same_list}/{runs}')
+
+
+if __name__ == '__main__':
+    main()
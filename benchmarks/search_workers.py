@@ -0,0 +1,94 @@
+"""Compare searching on the handler threads with searching in worker processes
+
+Run from the repository root, after the bot cached the documentation inventory once:
+
+    python -m benchmarks.search_workers [processes ...]
+
+Each setting has THREADS threads make inline-query-like searches, none answered from the cache, while
+another thread stands in for the other handlers doing a bit of pure Python work now and then. Printed are
+the searches made per second and how long that other work took, which is what the GIL makes wait.
+"""
+import random
+import sys
+import threading
+import time
+
+from search import search
+
+THREADS = 8
+SEARCHES = 400
+PROBE_INTERVAL = 0.01
+
+
+def queries(amount):
+    rng = random.Random(0)
+    names = search._index.names
+    result = []
+    for _ in range(amount):
+        word = rng.choice(names).split('.')[-1]
+        # Every query differs, so none is answered from the cache
+        cut = rng.randint(max(1, len(word) // 2), len(word))
+        result.append(f'{word[:cut]}{rng.choice("aeiou")}{len(result)}')
+    return result
+
+
+def probe_work():
+    return sum(len(str(i)) for i in range(2000))
+
+
+def run(api_index, processes):
+    if processes:
+        search.start_workers(processes)
+    search._index.results.clear()
+    pending = queries(SEARCHES)
+    lock = threading.Lock()
+    done = threading.Event()
+    probes = []
+
+    def searcher():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                query = pending.pop()
+            search.docs(query, amount=10, threshold=20)
+            search.api_docs(query, api_index)
+
+    def prober():
+        while not done.is_set():
+            start = time.perf_counter()
+            probe_work()
+            probes.append(time.perf_counter() - start)
+            time.sleep(PROBE_INTERVAL)
+
+    threads = [threading.Thread(target=searcher) for _ in range(THREADS)]
+    probe = threading.Thread(target=prober)
+    probe.start()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    probe.join()
+    search.stop_workers()
+
+    probes.sort()
+    return SEARCHES / elapsed, probes[len(probes) // 2] * 1000, probes[int(len(probes) * 0.95)] * 1000
+
+
+def main():
+    if not len(search._index):
+        sys.exit('No cached documentation inventory, run the bot once first')
+    api_index = search.api_index
+    settings = [0] + [int(arg) for arg in sys.argv[1:]] if len(sys.argv) > 1 else [0, 2, 4]
+
+    print(f'{"processes":<12}{"searches/s":>12}{"probe p50 ms":>14}{"probe p95 ms":>14}')
+    for processes in settings:
+        per_second, p50, p95 = run(api_index, processes)
+        print(f'{processes or "-":<12}{per_second:>12.0f}{p50:>14.2f}{p95:>14.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,57 +1,139 @@
-from uuid import uuid4
+import hashlib
+import logging
+import threading
+from collections import namedtuple
 
 from telegram import InlineQueryResultArticle, InputTextMessageContent, ParseMode
 from telegram.ext import InlineQueryHandler, run_async
 
+import metrics
 from components import taghints
 from rules_bot import fuzzy_replacements_markdown
 from search import search, DOCS_URL
+from util import TTLCache
 
+# Telegram sends a query for nearly every keystroke, and the same ones come back a lot. The results cached
+# for a query are also where its later pages are read from
+results_cache = TTLCache(maxsize=512, ttl=60)
+# Articles sent per answer, Telegram asks for the next page with the offset given when the user scrolls down
+PAGE_SIZE = 10
+DOCS_AMOUNT = 10
+# Answers only depend on the query, so Telegram may answer it for everyone for this long
+CACHE_TIME = 60 * 60
+# Users whose newest inline query is remembered, and for how long, well past the time Telegram waits for an answer
+LATEST_QUERIES_SIZE = 10000
+LATEST_QUERIES_TTL = 60
 
-def article(title='', description='', message_text=''):
-    return InlineQueryResultArticle(
-        id=uuid4(),
-        title=title,
-        description=description,
-        input_message_content=InputTextMessageContent(
-            message_text=message_text,
-            parse_mode=ParseMode.MARKDOWN,
-            disable_web_page_preview=True)
-    )
+# What an article will be made of, articles are only made for the page being sent
+Result = namedtuple('Result', 'title, description, message_text, reply_markup')
+
+logger = logging.getLogger(__name__)
+
+
+class LatestQueries:
+    """Newest inline query of every user, Telegram only shows the answer to that one anyway"""
+
+    def __init__(self):
+        self.answered = 0
+        self.dropped = 0
+        # Kept after the newest query is answered, older ones may still be waiting or searching
+        self._latest = TTLCache(LATEST_QUERIES_SIZE, LATEST_QUERIES_TTL)
+        self._lock = threading.Lock()
+
+    def received(self, inline_query):
+        # Called in the order the updates arrive, before the query is handed to the thread pool
+        self._latest.set(inline_query.from_user.id, inline_query.id)
+
+    def superseded(self, inline_query):
+        return self._latest.get(inline_query.from_user.id, inline_query.id) != inline_query.id
+
+    def done(self, inline_query, answered):
+        with self._lock:
+            if answered:
+                self.answered += 1
+            else:
+                self.dropped += 1
+                if self.dropped % 100 == 0:
+                    logger.info(f'Dropped {self.dropped} superseded inline queries, answered {self.answered}')
 
 
-def hint_article(msg, reply_markup, key):
+latest_queries = LatestQueries()
+metrics.register_cache('inline_results', lambda: results_cache)
+metrics.register('inline_queries_total', 'Inline queries answered, and dropped because the user typed on',
+                 lambda: {'answered': latest_queries.answered, 'dropped': latest_queries.dropped},
+                 'counter', 'outcome')
+
+
+def result(title='', description='', message_text='', reply_markup=None):
+    return Result(title, description, message_text, reply_markup)
+
+
+def hint_result(msg, reply_markup, key):
+    return result(title='Send hint on {}'.format(key.capitalize()), message_text=msg, reply_markup=reply_markup)
+
+
+def article(item):
+    # Ids come from the content, so the same result is the same article in every answer and page
+    content = '\0'.join((item.title, item.description, item.message_text)).encode()
     return InlineQueryResultArticle(
-        id=key,
-        title='Send hint on {}'.format(key.capitalize()),
+        id=hashlib.blake2b(content, digest_size=16).hexdigest(),
+        title=item.title,
+        description=item.description,
         input_message_content=InputTextMessageContent(
-            message_text=msg,
-            parse_mode="Markdown",
-            disable_web_page_preview=True
-        ),
-        reply_markup=reply_markup
+            message_text=item.message_text,
+            parse_mode=ParseMode.MARKDOWN,
+            disable_web_page_preview=True),
+        reply_markup=item.reply_markup
     )
 
 
 @run_async
-def inline_query(bot, update, all_list, threshold=20):
-    query = update.inline_query.query
+@metrics.timed('inline_query')
+def inline_query(bot, update, api_index, threshold=20):
+    inline = update.inline_query
+    query = inline.query
+    start = int(inline.offset) if inline.offset.isdigit() else 0
+
+    results_list = results_cache.get((query, threshold))
+    if results_list is None and not latest_queries.superseded(inline):
+        results_list = inline_results(query, api_index, threshold, lambda: latest_queries.superseded(inline))
+        if results_list is not None:
+            results_cache.set((query, threshold), results_list)
+
+    # The user typed on while this query waited or was being searched
+    if results_list is None or latest_queries.superseded(inline):
+        latest_queries.done(inline, answered=False)
+        return
+
+    end = start + PAGE_SIZE
+    bot.answerInlineQuery(inline.id, results=[article(each) for each in results_list[start:end]],
+                          cache_time=CACHE_TIME, is_personal=False,
+                          next_offset=str(end) if end < len(results_list) else '',
+                          switch_pm_text='Help', switch_pm_parameter='inline-help')
+    latest_queries.done(inline, answered=True)
+
+
+def inline_results(query, api_index, threshold=20, superseded=lambda: False):
+    """Ranked Results for the query, or None if `superseded` says they're no longer needed halfway through"""
     results_list = list()
 
     if len(query) > 0:
 
         msg, reply_markup, key = taghints.get_hint_data(query)
         if msg is not None:
-            results_list.append(hint_article(msg, reply_markup, key))
+            results_list.append(hint_result(msg, reply_markup, key))
 
         modified, replaced = fuzzy_replacements_markdown(query)
         if modified:
-            results_list.append(article(
+            results_list.append(result(
                 title="Replace links",
                 description=', '.join(modified),
                 message_text=replaced))
 
-        docs = search.docs(query, threshold=threshold)
+        if superseded():
+            return None
+
+        docs = search.docs(query, amount=DOCS_AMOUNT, threshold=threshold)
 
         if docs:
             for doc in docs:
@@ -59,13 +141,16 @@ def inline_query(bot, update, all_list, threshold=20):
                        f'_Telethon_ documentation for this {doc.type}:\n' \
                        f'[{doc.full_name}]({doc.url})'
 
-                results_list.append(article(
+                results_list.append(result(
                     title=f'{doc.full_name}',
                     description="Telethon documentation",
                     message_text=text,
                 ))
 
-        api_docs = search.api_docs(query, all_list)
+        if superseded():
+            return None
+
+        api_docs = search.api_docs(query, api_index)
 
         if api_docs:
             for doc in api_docs:
@@ -73,7 +158,7 @@ def inline_query(bot, update, all_list, threshold=20):
                        f'_Telethon_ API Docs for this {doc.type}:\n' \
                        f'[{doc.full_name}]({doc.url})'
 
-                results_list.append(article(
+                results_list.append(result(
                     title=f'{doc.full_name}',
                     description="Telethon API Details",
                     message_text=text,
@@ -81,7 +166,7 @@ def inline_query(bot, update, all_list, threshold=20):
 
         # "No results" entry
         if len(results_list) == 0:
-            results_list.append(article(
+            results_list.append(result(
                 title='❌ No results.',
                 description='',
                 message_text=f'Click [here]({DOCS_URL}) to see the full documentation of _Telethon_',
@@ -89,15 +174,18 @@ def inline_query(bot, update, all_list, threshold=20):
 
     else:  # no query input
         results_list = list()
-        results_list.append(article(
+        results_list.append(result(
             title='❌ No results.',
             description='',
             message_text=f'Click [here]({DOCS_URL}) to see the full documentation of _Telethon_',
         ))
 
-    bot.answerInlineQuery(update.inline_query.id, results=results_list[:30], switch_pm_text='Help',
-                          switch_pm_parameter='inline-help')
+    return results_list
+
 
+def register(dispatcher, api_index):
+    def on_inline_query(bot, update):
+        latest_queries.received(update.inline_query)
+        inline_query(bot, update, api_index)
 
-def register(dispatcher, all_list):
-    dispatcher.add_handler(InlineQueryHandler(lambda bot, update: inline_query(bot, update, all_list)))
+    dispatcher.add_handler(InlineQueryHandler(on_inline_query))
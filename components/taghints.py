@@ -1,8 +1,11 @@
+import re
+
 from telegram import InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.error import BadRequest
-from telegram.ext import CommandHandler, RegexHandler, run_async
+from telegram.ext import CommandHandler, run_async
 
 import const
+import metrics
 import util
 
 HINTS = {
@@ -29,6 +32,7 @@ HINTS = {
 
 
 @run_async
+@metrics.timed('list_available_hints')
 def list_available_hints(bot, update):
     message = "You can use the following hashtags to guide new members:\n\n"
     message += '\n'.join(
@@ -65,6 +69,7 @@ def get_hint_data(text):
 
 
 @run_async
+@metrics.timed('hint_handler')
 def hint_handler(bot, update):
     text = update.message.text
     reply_to = update.message.reply_to_message
@@ -83,7 +88,11 @@ def hint_handler(bot, update):
             pass
 
 
-def register(dispatcher):
+def add_routes(router):
     for hashtag in HINTS.keys():
-        dispatcher.add_handler(RegexHandler(r'{}.*'.format(hashtag), hint_handler))
+        # The hint takes the place of the message, which has nothing left for the other routes
+        router.add(r'\A' + re.escape(hashtag), hint_handler, stop=True)
+
+
+def register(dispatcher):
     dispatcher.add_handler(CommandHandler(('hints', 'listhints'), list_available_hints))
@@ -0,0 +1,271 @@
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from heapq import nsmallest
+from itertools import accumulate
+
+from fuzzywuzzy import fuzz
+
+from util import TTLCache
+
+try:
+    import numpy
+    from rapidfuzz import fuzz as rapid_fuzz, process
+except ImportError:
+    numpy = None
+
+DOC_TYPES = ('py:staticmethod', 'py:exception', 'py:method', 'py:module', 'py:class', 'py:attribute', 'py:data',
+             'py:function')
+
+# These values are basically random :/
+TYPE_WEIGHTS = {'py:module': 0.75, 'py:class': 1.10, 'py:attribute': 0.85}
+
+# How many of the entries sharing the most trigrams with a query get scored in full. Common names like
+# `to_dict` share every trigram with thousands of entries, among those the ones holding the fewest other
+# trigrams, the shortest names, are kept, which are the ones scoring best.
+# Tolerance, measured on 608 queries made of the last one and two components of inventory names: the top
+# result is always that of the full scan, and about 4% of the full scan's top 10 (mostly ranks 5 to 10) is
+# missing, replaced by lower scoring entries.
+MAX_CANDIDATES = 250
+# Search results are remembered for a while, inline queries repeat the same queries and +Symbols+ a lot
+RESULTS_CACHE_SIZE = 1024
+RESULTS_CACHE_TTL = 10 * 60
+# What follows the page in the url of an entry: its name, "module-" and its name, or something else
+ANCHOR_NAME, ANCHOR_MODULE, ANCHOR_OTHER = range(3)
+
+
+def trigrams(word):
+    word = f' {word.lower()} '
+    return {word[i:i + 3] for i in range(len(word) - 2)}
+
+
+class StringTable:
+    """Strings stored end to end in a single one, read back by position"""
+
+    def __init__(self, strings):
+        self._text = ''.join(strings)
+        self._ends = array('I', accumulate(len(string) for string in strings))
+
+    def __getitem__(self, position):
+        return self._text[self._ends[position - 1] if position else 0:self._ends[position]]
+
+    def __len__(self):
+        return len(self._ends)
+
+
+class DocsIndex:
+    """Columnar store of the documentation inventory with trigram postings over the dotted name components
+
+    Everything is kept in arrays of numbers and strings shared between entries, the Doc of an entry is only
+    made when it is a result.
+    """
+
+    def __init__(self, entries):
+        """Indexes the entries of the python domain out of entries, InventoryEntries or alike"""
+        names = []
+        # Index into DOC_TYPES
+        self.types = array('B')
+        self.weights = array('d')
+        self.depths = array('B')
+        # How many distinct trigrams the name components hold, of two entries sharing as many with a query the
+        # one holding fewer others is the closer match
+        self.gram_counts = array('H')
+        # Distinct dotted components, and components[d][i] the one that is the d-th of names[i] from the end
+        self.strings = ['']
+        self.components = []
+        self.postings = {}
+        # Distinct pages of the urls, and for every entry its page times 3 plus what the anchor is made of
+        self.pages = []
+        self.url_codes = array('I')
+        self.other_urls = {}
+        # Results of searches on this index, dropped with it when a new inventory is loaded
+        self.results = TTLCache(RESULTS_CACHE_SIZE, RESULTS_CACHE_TTL)
+
+        string_codes = {'': 0}
+        page_codes = {}
+        symbols = []
+        type_codes = {typ: code for code, typ in enumerate(DOC_TYPES)}
+        # An entry listed again keeps its place and takes the later url, as Sphinx has it
+        seen = {}
+        for entry in entries:
+            type_code = type_codes.get(entry.type)
+            if type_code is None:
+                continue
+            name = entry.name
+            position = seen.get((type_code, name))
+            if position is not None:
+                self.other_urls.pop(position, None)
+                self.url_codes[position] = self._url_code(position, name, entry.url, page_codes)
+                continue
+
+            weight = TYPE_WEIGHTS.get(entry.type, 1)
+            name_bits = name.split('.')
+            position = seen[type_code, name] = len(names)
+            names.append(name)
+            self.types.append(type_code)
+            self.weights.append(weight)
+            self.depths.append(len(name_bits))
+            self.url_codes.append(self._url_code(position, name, entry.url, page_codes))
+
+            while len(self.components) < len(name_bits):
+                self.components.append(array('I', [0]) * position)
+            for depth, column in enumerate(self.components):
+                bit = name_bits[-1 - depth] if depth < len(name_bits) else ''
+                code = string_codes.get(bit)
+                if code is None:
+                    code = string_codes[bit] = len(self.strings)
+                    self.strings.append(bit)
+                column.append(code)
+
+            grams = set()
+            for bit in name_bits:
+                grams |= trigrams(bit)
+            self.gram_counts.append(min(len(grams), 0xFFFF))
+            for gram in grams:
+                self.postings.setdefault(gram, array('I')).append(position)
+
+            for depth in range(1, len(name_bits) + 1):
+                symbols.append((hash('.'.join(name_bits[-depth:]).casefold()), position))
+
+        self.names = StringTable(names)
+        if len(names) <= 1 << 16:
+            # Positions fit in half the room then
+            self.postings = {gram: array('H', positions) for gram, positions in self.postings.items()}
+        if numpy is not None:
+            self.weights = numpy.array(self.weights)
+            self.depths = numpy.array(self.depths)
+            self.gram_counts = numpy.array(self.gram_counts, dtype=numpy.int64)
+
+        # Every dotted suffix of the names, case-folded, by its hash, sorted to be found by bisection, and the
+        # position of every entry it ends. Hashes of strings differ between runs, but not in one process and
+        # those forked from it
+        symbols.sort()
+        self.symbol_hashes = array('q', (key for key, _ in symbols))
+        self.symbol_positions = array('I', (position for _, position in symbols))
+
+    def _url_code(self, position, name, url, page_codes):
+        page, _, anchor = url.partition('#')
+        code = page_codes.get(page)
+        if code is None:
+            code = page_codes[page] = len(self.pages)
+            self.pages.append(page)
+
+        if anchor == name:
+            return code * 3 + ANCHOR_NAME
+        if anchor == 'module-' + name:
+            return code * 3 + ANCHOR_MODULE
+        self.other_urls[position] = url
+        return code * 3 + ANCHOR_OTHER
+
+    def __len__(self):
+        return len(self.names)
+
+    def type(self, position):
+        return DOC_TYPES[self.types[position]]
+
+    def url(self, position):
+        page, anchor = divmod(self.url_codes[position], 3)
+        if anchor == ANCHOR_NAME:
+            return f'{self.pages[page]}#{self.names[position]}'
+        if anchor == ANCHOR_MODULE:
+            return f'{self.pages[page]}#module-{self.names[position]}'
+        return self.other_urls[position]
+
+    def symbol(self, name):
+        """Position of the entry a dotted name like `TelegramClient` or `events.NewMessage` ends, or None
+
+        Of the entries it ends in any case, the one the fuzzy search ranks first for name wins, so both agree.
+        None when it ends none as it is written, that's left to the fuzzy search.
+        """
+        folded = name.casefold()
+        key = hash(folded)
+        positions = []
+        written = False
+        i = bisect_left(self.symbol_hashes, key)
+        while i < len(self.symbol_hashes) and self.symbol_hashes[i] == key:
+            position = self.symbol_positions[i]
+            full_name = self.names[position]
+            # Two suffixes may share a hash, the entry has to end with the one looked for
+            if full_name.casefold() == folded or full_name.casefold().endswith('.' + folded):
+                positions.append(position)
+                written = written or full_name == name or full_name.endswith('.' + name)
+            i += 1
+
+        if not written:
+            return None
+        if len(positions) == 1:
+            return positions[0]
+        # In inventory order, the first of the best scoring ones wins like in the fuzzy search
+        scores = self.score(list(reversed(name.split('.'))), positions)
+        return positions[scores.index(max(scores))]
+
+    def candidates(self, query_bits, amount=MAX_CANDIDATES):
+        """Positions of the entries worth scoring for the query, in inventory order"""
+        # Queries made only of components shorter than a trigram say too little, so scan everything
+        if all(len(bit) < 3 for bit in query_bits):
+            return range(len(self.names))
+
+        grams = set()
+        for bit in query_bits:
+            if bit:
+                grams |= trigrams(bit)
+        postings = [self.postings[gram] for gram in grams if gram in self.postings]
+        if numpy is not None:
+            return self._candidates_batch(postings, amount)
+
+        counts = Counter()
+        for positions in postings:
+            counts.update(positions)
+        gram_counts = self.gram_counts
+        best = nsmallest(amount, counts.items(), key=lambda item: (-item[1], gram_counts[item[0]], item[0]))
+        return sorted(position for position, _ in best)
+
+    def _candidates_batch(self, postings, amount):
+        if not postings:
+            return []
+        counts = numpy.bincount(numpy.concatenate([numpy.frombuffer(positions, dtype=positions.typecode)
+                                                   for positions in postings]))
+        present = numpy.flatnonzero(counts)
+        if len(present) > amount:
+            # Same order as the fallback: most trigrams shared, then fewest others, then the first entries
+            keys = (counts[present].astype(numpy.int64) << 48) - (self.gram_counts[present] << 32) - present
+            present = numpy.sort(present[numpy.argpartition(-keys, amount)[:amount]])
+        return present.tolist()
+
+    def score(self, query_bits, positions):
+        """Fuzzy scores of the entries at positions for the reversed query components, type weights applied"""
+        if numpy is None:
+            return self._score_each(query_bits, positions)
+        return self._score_batch(query_bits, positions)
+
+    def _score_each(self, query_bits, positions):
+        scores = []
+        full_query = str(query_bits)
+        for position in positions:
+            score = 0
+            for depth in range(min(len(query_bits), self.depths[position])):
+                score += fuzz.ratio(query_bits[depth], self.strings[self.components[depth][position]])
+            score += fuzz.ratio(full_query, self.names[position])
+            scores.append(score * self.weights[position])
+        return scores
+
+    def _score_batch(self, query_bits, positions):
+        positions = numpy.asarray(positions, dtype=numpy.intp)
+        depths = self.depths[positions]
+        scores = numpy.zeros(len(positions))
+
+        for depth, bit in enumerate(query_bits[:len(self.components)]):
+            column = self.components[depth]
+            ratios = self._ratios(bit, [self.strings[column[position]] for position in positions])
+            ratios[depths <= depth] = 0
+            scores += ratios
+
+        # Like fuzzywuzzy, the query list is compared with the full name by its string form
+        scores += self._ratios(str(query_bits), [self.names[position] for position in positions])
+        scores *= self.weights[positions]
+        return scores.tolist()
+
+    @staticmethod
+    def _ratios(query, choices):
+        # Rounded like fuzzywuzzy does, so both scorers agree when python-Levenshtein backs it
+        return numpy.rint(process.cdist([query], choices, scorer=rapid_fuzz.ratio, dtype=numpy.float64)[0])
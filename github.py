@@ -0,0 +1,275 @@
+import html
+import json
+import logging
+import os
+import re
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import metrics
+from const import CACHE_DIR
+from util import TTLCache, connections
+
+# Seconds allowed for connecting and for every read, and for resolving all references of a message
+TIMEOUT = 5
+RESOLVE_TIMEOUT = 10
+MAX_REDIRECTS = 3
+# The title is at the top of the page, give up on pages that don't have it early
+MAX_TITLE_BYTES = 64 * 1024
+CHUNK_SIZE = 8 * 1024
+
+# Titles rarely change, and references that didn't resolve are tried again after a while
+REFERENCES_CACHE_SIZE = 4096
+REFERENCES_TTL = 24 * 60 * 60
+UNRESOLVED_TTL = 10 * 60
+REFERENCES_CACHE = os.path.join(CACHE_DIR, 'github_references.json')
+
+# Whatever a reference needs somewhere in the text, for the router to tell which messages may hold one
+REFERENCE_HINT = r'(?i:\#|GH-|PR-|[0-9a-f]{40})'
+# Where a reference ends: a number after "#", "GH-" or "PR-", or a full commit sha after an "@" or on its own.
+# Without the "@", a sha is the last 40 characters of a longer hex run, the ones in front of it being the user
+SHA_PATTERN = r'(?:@|(?=[0-9a-f]{40}(?![0-9a-f])))(?P<sha>[0-9a-f]{40})'
+REFERENCE_PATTERN = re.compile(r'(?i)(?:\#|GH-|PR-)(?P<number>\d*)|' + SHA_PATTERN)
+BARE_SHA_PATTERN = re.compile('(?i)' + SHA_PATTERN)
+# Characters that can't be part of a user or repo name
+NAME_SEPARATORS = frozenset('/#@')
+TITLE_PATTERN = re.compile(rb'<title[^>]*>(.*?)</title>', re.IGNORECASE | re.DOTALL)
+
+logger = logging.getLogger(__name__)
+
+
+class ReferenceCache:
+    """Resolved (title, type) of GitHub references by (repo, number or sha), optionally saved to a file"""
+
+    def __init__(self, path=None, maxsize=REFERENCES_CACHE_SIZE, ttl=REFERENCES_TTL, unresolved_ttl=UNRESOLVED_TTL):
+        self.path = path
+        self.unresolved_ttl = unresolved_ttl
+        self._cache = TTLCache(maxsize, ttl)
+
+    @staticmethod
+    def key(repo, ref):
+        # GitHub doesn't care about the case of either
+        return repo.lower(), ref.lower()
+
+    def get(self, key, default=None):
+        """The cached (title, type), None if it didn't resolve, or default if unknown"""
+        return self._cache.get(key, default)
+
+    def set(self, key, value):
+        self._cache.set(key, value, None if value else self.unresolved_ttl)
+
+    def load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path) as file:
+                entries = json.load(file)
+            if not isinstance(entries, list):
+                raise ValueError(f'expected a list of references, got {type(entries).__name__}')
+        except FileNotFoundError:
+            return
+        except Exception:
+            logger.exception('Could not load the cached GitHub references')
+            return
+
+        now = time.time()
+        skipped = 0
+        for entry in entries:
+            # A row written by another version, or edited by hand, is skipped rather than stopping the bot
+            try:
+                repo, ref, value, expires = entry
+                if not (isinstance(repo, str) and isinstance(ref, str) and isinstance(expires, (int, float))):
+                    raise ValueError
+                if value:
+                    title, typ = value
+                    value = (str(title), str(typ))
+            except (TypeError, ValueError):
+                skipped += 1
+                continue
+            if expires > now:
+                self._cache.set((repo, ref), value or None, expires - now)
+        if skipped:
+            logger.warning(f'Skipped {skipped} malformed cached GitHub references')
+
+    def save(self):
+        if not self.path:
+            return
+        now = time.time()
+        entries = [[repo, ref, value, now + ttl] for (repo, ref), value, ttl in self._cache.items()]
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump(entries, file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def __len__(self):
+        return len(self._cache)
+
+
+executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='github')
+references = ReferenceCache(REFERENCES_CACHE)
+metrics.register_cache('github_references', lambda: references._cache)
+
+Reference = namedtuple('Reference', 'user, repo, number, sha')
+
+
+def _name_start(text, last, end, pending=()):
+    """Where the user or repo name ending at end starts, not looking further back than last
+
+    Reaching a pending match skips to where its own name starts, which is known already.
+    """
+    skip_to = None
+    for match, _, name_start in reversed(pending):
+        if match.end() <= end:
+            last, skip_to = match.end(), name_start
+            break
+
+    start = end
+    while start > last and text[start - 1] not in NAME_SEPARATORS and not text[start - 1].isspace():
+        start -= 1
+    return skip_to if start == last and skip_to is not None else start
+
+
+def _reference(text, match, user_start, name_start):
+    """The reference ending with match, named by the text from user_start, or name_start if there's no user"""
+    start = match.start()
+    user = repo = None
+    if user_start < name_start:
+        user, repo = text[user_start:name_start - 1], text[name_start:start]
+    elif name_start < start:
+        user = text[name_start:start]
+    number, sha = match.groupdict().get('number'), match.group('sha')
+    # A lone "#" isn't a reference
+    return Reference(user, repo, number, sha) if number or sha else None
+
+
+def find_references(text):
+    """The GitHub references in text, as `[user[/repo]](#|GH-|PR-)number` or `[user[/repo]@]sha`
+
+    References are found by where they end, and the name in front of each is read backwards up to the
+    previous one, so every character is looked at a bounded number of times. Like the all-in-one regex
+    used before, a name takes in any "GH-", "PR-" or sha written into it: `gh-1gh-2` is user "gh-1", #2.
+    """
+    found = []
+    last = 0
+    # Matches made of name characters only, with where their user and name start, until it's known
+    # whether a later match takes them into its name
+    pending = []
+    match = REFERENCE_PATTERN.search(text)
+    while match:
+        # The digits after a "GH-" or "PR-" in a name may start a sha instead, which then wins
+        if match.group('number') and text[match.start()] not in NAME_SEPARATORS:
+            sha = BARE_SHA_PATTERN.search(text, match.start() + 3, match.end() + 41)
+            if sha and sha.start() < match.end():
+                match = sha
+
+        start = match.start()
+        while True:
+            name_start = user_start = _name_start(text, last, start, pending)
+            if last + 1 < name_start and text[name_start - 1] == '/':
+                user_start = _name_start(text, last, name_start - 1, pending)
+                if user_start == name_start - 1:
+                    user_start = name_start
+            # Pending matches whose own user starts in front of this one's are references of their own,
+            # and this name ends at them
+            if not pending or pending[0][1] >= user_start:
+                break
+            previous = pending.pop(0)
+            found.append(_reference(text, *previous))
+            last = previous[0].end()
+
+        if name_start < start:
+            # The pending matches left are part of this name
+            pending.clear()
+        else:
+            # A match without a name has no user either, but if a later match takes it in, that one's name
+            # does have a user and takes in the pending matches in it too
+            user_start = name_start
+
+        if text[start] in NAME_SEPARATORS:
+            found.extend(_reference(text, *each) for each in pending)
+            found.append(_reference(text, match, user_start, name_start))
+            pending.clear()
+            last = match.end()
+        else:
+            pending.append((match, user_start, name_start))
+        match = REFERENCE_PATTERN.search(text, match.end())
+
+    found.extend(_reference(text, *each) for each in pending)
+    return [reference for reference in found if reference]
+
+
+@metrics.timed('github.page_title')
+def get_page_title(url):
+    """Title of the web page at url, reading the response only up to the end of its <title>
+
+    GitHub sends its issue, pull request and commit pages chunked and hundreds of KiB long, so the rest is
+    not read and the connection of a successful lookup is closed; the next one opens a new TLS connection.
+    Only redirects, error pages and small pages sent with a Content-Length leave a connection to reuse.
+    """
+    with connections.open(url, {'Accept': 'text/html'}, timeout=TIMEOUT, max_redirects=MAX_REDIRECTS) as response:
+        if response.status != 200:
+            response.read()
+            return None
+        return _read_title(response)
+
+
+def _read_title(response):
+    head = b''
+    while len(head) < MAX_TITLE_BYTES and b'</title>' not in head.lower():
+        chunk = response.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        head += chunk
+
+    match = TITLE_PATTERN.search(head)
+    if not match:
+        return None
+    charset = response.headers.get_content_charset() or 'utf-8'
+    return html.unescape(match.group(1).decode(charset, 'replace')).strip()
+
+
+def get_title_and_type(url, sha=None):
+    title = get_page_title(url)
+    if not title:
+        return None
+    split = title.split(' · ')
+    if len(split) < 2:
+        return None
+    t = 'PR' if 'Pull Request' in split[1] else 'Issue'
+    if sha:
+        t = 'Commit'
+    return split[0], t
+
+
+def _resolve(key, url, sha):
+    try:
+        value = get_title_and_type(url, sha)
+    except Exception as e:
+        logger.warning(f'Could not resolve {url}: {e!r}')
+        value = None
+    references.set(key, value)
+    return value
+
+
+@metrics.timed('github.resolve_all')
+def resolve_all(wanted):
+    """Resolves (repo, number or sha, url, sha) references to a dict of url to (title, type), or None
+
+    Cached references are answered right away, the others are fetched concurrently.
+    """
+    resolved = {}
+    futures = {}
+    for repo, ref, url, sha in wanted:
+        key = references.key(repo, ref)
+        value = references.get(key, False)
+        if value is False:
+            futures[url] = executor.submit(_resolve, key, url, sha)
+        else:
+            resolved[url] = value
+
+    if futures:
+        wait(futures.values(), timeout=RESOLVE_TIMEOUT)
+        for url, future in futures.items():
+            resolved[url] = future.result() if future.done() else None
+    return resolved
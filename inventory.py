@@ -0,0 +1,70 @@
+"""Reader of the objects.inv files Sphinx writes, version 2, for the documentation search to not need Sphinx
+
+The file starts with four lines of header, the rest is compressed with zlib and holds an entry per line:
+
+    <name> <domain>:<role> <priority> <location> <display name>
+
+A location ending in "$" ends in the name, and a display name of "-" is the name.
+"""
+import posixpath
+import re
+import zlib
+from collections import namedtuple
+
+HEADER = b'# Sphinx inventory version 2'
+CHUNK_SIZE = 16 * 1024
+# The pattern Sphinx reads entries with, names may hold spaces so a name is whatever comes before the rest
+ENTRY_PATTERN = re.compile(r'(.+?)\s+(\S+)\s+(-?\d+)\s+?(\S*)\s+(.*)')
+
+InventoryEntry = namedtuple('InventoryEntry', 'name, type, priority, url, display_name')
+
+
+def read_inventory(file, base_url):
+    """The InventoryEntries of the objects.inv open in binary mode as file, read and decompressed bit by bit
+
+    Locations are joined to base_url like Sphinx does. Entries come in the order of the file, and only the first
+    of a module listed twice, which old Sphinx versions did.
+    """
+    header = file.readline().rstrip()
+    if header != HEADER:
+        raise ValueError(f'Not a version 2 inventory: {header[:64]!r}')
+    # Project name and version
+    file.readline()
+    file.readline()
+    if b'zlib' not in file.readline():
+        raise ValueError('Inventory is not compressed with zlib')
+
+    decompressor = zlib.decompressobj()
+    modules = set()
+    rest = b''
+    while True:
+        chunk = file.read(CHUNK_SIZE)
+        lines = (rest + (decompressor.decompress(chunk) if chunk else decompressor.flush())).split(b'\n')
+        rest = b'' if not chunk else lines.pop()
+        for line in lines:
+            # Lines are split on the same characters Sphinx splits them on
+            for text in line.decode().splitlines():
+                entry = _entry(text, base_url)
+                if entry is None:
+                    continue
+                if entry.type == 'py:module':
+                    if entry.name in modules:
+                        continue
+                    modules.add(entry.name)
+                yield entry
+        if not chunk:
+            return
+
+
+def _entry(line, base_url):
+    match = ENTRY_PATTERN.match(line.rstrip())
+    if not match:
+        return None
+    name, typ, priority, location, display_name = match.groups()
+    # Types are "domain:role", checked here rather than in the pattern which would backtrack a lot otherwise
+    if ':' not in typ:
+        return None
+    if location.endswith('$'):
+        location = location[:-1] + name
+    return InventoryEntry(name, typ, int(priority), posixpath.join(base_url, location),
+                          name if display_name == '-' else display_name)
@@ -0,0 +1,243 @@
+"""Runtime metrics of the bot, served in the Prometheus text format and summarized by /stats
+
+Enabled by a [METRICS] section in bot.ini, both settings optional and shown with their defaults:
+
+    [METRICS]
+    listen = 127.0.0.1
+    port = 9464
+
+Latencies are recorded as they happen, everything else is read from where it's kept already when asked for.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LISTEN = '127.0.0.1'
+PORT = 9464
+PREFIX = 'rules_bot'
+# Upper bounds in seconds, from cache hits up to GitHub pages timing out
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+logger = logging.getLogger(__name__)
+
+started = time.monotonic()
+
+
+class Histogram:
+    """Counts of observed values by the bucket they fall in, the last bucket taking those above all bounds"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q):
+        """Estimate of the q-quantile, interpolated within its bucket like Prometheus does"""
+        with self._lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return None
+
+        rank = q * count
+        below = 0
+        for i, bucket_count in enumerate(counts):
+            if below + bucket_count >= rank and bucket_count:
+                if i == len(self.buckets):
+                    return self.buckets[-1]
+                lower = self.buckets[i - 1] if i else 0
+                return lower + (self.buckets[i] - lower) * (rank - below) / bucket_count
+            below += bucket_count
+        return self.buckets[-1]
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+latencies = {}
+_latencies_lock = threading.Lock()
+# name -> (help, type, label, collect), see register
+_collected = {}
+# name -> function returning the cache, which may be replaced over time
+_caches = {}
+
+
+def latency(name):
+    """The latency histogram of name, made on first use"""
+    histogram = latencies.get(name)
+    if histogram is None:
+        with _latencies_lock:
+            histogram = latencies.setdefault(name, Histogram())
+    return histogram
+
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        latency(name).observe(time.perf_counter() - start)
+
+
+def timed(name):
+    """Records how long every call to the decorated function takes, put it below @run_async to leave out the
+    time spent waiting for a worker"""
+    def decorator(function):
+        histogram = latency(name)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def register(name, help, collect, type='gauge', label=None):
+    """Exposes what collect() returns, either a number or a dict of numbers by the value of label"""
+    _collected[name] = (help, type, label, collect)
+
+
+def counter(name, help):
+    """A Counter exposed as name"""
+    result = Counter()
+    register(name, help, lambda: result.value, 'counter')
+    return result
+
+
+def register_cache(name, get_cache):
+    """Exposes the hits, misses and size of the cache returned by get_cache(), a TTLCache or alike"""
+    _caches[name] = get_cache
+
+
+def _cache_stats():
+    stats = {}
+    for name, get_cache in list(_caches.items()):
+        cache = get_cache()
+        stats[name] = (cache.hits, cache.misses, len(cache))
+    return stats
+
+
+def _collect():
+    """(name, help, type, label, value) of everything registered, skipping what fails"""
+    collected = []
+    for name, (help, type, label, collect) in list(_collected.items()):
+        try:
+            collected.append((name, help, type, label, collect()))
+        except Exception:
+            logger.exception(f'Could not collect metric {name}')
+    return collected
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def exposition():
+    """All metrics in the Prometheus text format"""
+    lines = [
+        f'# HELP {PREFIX}_uptime_seconds Seconds since the bot started',
+        f'# TYPE {PREFIX}_uptime_seconds gauge',
+        f'{PREFIX}_uptime_seconds {_format_value(time.monotonic() - started)}',
+        f'# HELP {PREFIX}_latency_seconds Time taken by handlers and the lookups they make',
+        f'# TYPE {PREFIX}_latency_seconds histogram',
+    ]
+    for name, histogram in sorted(latencies.items()):
+        with histogram._lock:
+            counts, count, total = list(histogram.counts), histogram.count, histogram.sum
+        cumulative = 0
+        for bound, bucket_count in zip(histogram.buckets + ('+Inf',), counts):
+            cumulative += bucket_count
+            lines.append(f'{PREFIX}_latency_seconds_bucket{{name="{name}",le="{bound}"}} {cumulative}')
+        lines.append(f'{PREFIX}_latency_seconds_sum{{name="{name}"}} {_format_value(total)}')
+        lines.append(f'{PREFIX}_latency_seconds_count{{name="{name}"}} {count}')
+
+    caches = _cache_stats()
+    collected = [
+        ('cache_hits_total', 'Lookups answered from the cache', 'counter', 'cache',
+         {name: hits for name, (hits, _, _) in caches.items()}),
+        ('cache_misses_total', 'Lookups the cache had no live entry for', 'counter', 'cache',
+         {name: misses for name, (_, misses, _) in caches.items()}),
+        ('cache_entries', 'Entries held by the cache', 'gauge', 'cache',
+         {name: size for name, (_, _, size) in caches.items()}),
+    ]
+    for name, help, type, label, value in collected + _collect():
+        lines.append(f'# HELP {PREFIX}_{name} {help}')
+        lines.append(f'# TYPE {PREFIX}_{name} {type}')
+        if isinstance(value, dict):
+            lines.extend(f'{PREFIX}_{name}{{{label}="{key}"}} {_format_value(each)}' for key, each in value.items())
+        else:
+            lines.append(f'{PREFIX}_{name} {_format_value(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+def summary():
+    """Plain text overview of the metrics, for /stats"""
+    uptime = int(time.monotonic() - started)
+    lines = [f'Up {uptime // 86400}d {uptime // 3600 % 24}h {uptime // 60 % 60}m', '',
+             f'{"latency":<20}{"calls":>8}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}']
+    for name, histogram in sorted(latencies.items()):
+        if histogram.count:
+            lines.append(f'{name:<20}{histogram.count:>8}' +
+                         ''.join(f'{histogram.quantile(q) * 1000:>9.1f}' for q in (0.5, 0.95, 0.99)))
+
+    lines += ['', f'{"cache":<20}{"hit rate":>9}{"lookups":>9}{"entries":>9}']
+    for name, (hits, misses, size) in sorted(_cache_stats().items()):
+        rate = f'{hits / (hits + misses):.0%}' if hits + misses else '-'
+        lines.append(f'{name:<20}{rate:>9}{hits + misses:>9}{size:>9}')
+
+    lines.append('')
+    for name, _, _, _, value in _collect():
+        if isinstance(value, dict):
+            value = ', '.join(f'{key} {each}' for key, each in value.items())
+        lines.append(f'{name}: {value}')
+    return '\n'.join(lines)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = exposition().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def serve(config):
+    """Serves /metrics as configured in the [METRICS] section of config, which must be there"""
+    section = config['METRICS']
+    server = ThreadingHTTPServer((section.get('listen', LISTEN), section.getint('port', PORT)), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f'Metrics served on http://{server.server_address[0]}:{server.server_address[1]}/metrics')
+    return server
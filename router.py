@@ -0,0 +1,69 @@
+"""Finds every trigger a group message holds in a single scan, and calls the handlers of those found"""
+import re
+from collections import namedtuple
+
+from telegram.ext import Filters, MessageHandler
+
+Route = namedtuple('Route', 'pattern, callback, pass_groups, pass_chat_data, edited, stop')
+
+
+class Router:
+    """Handlers of messages holding some pattern, looked for all at once with their patterns joined into one
+
+    The patterns are joined as alternatives in the order they were added, so where two could match at the same
+    place the one added first takes it. A pattern may only set flags for itself, as in `(?i:...)`, and only
+    its own unnamed groups are handed to the handler.
+    """
+
+    def __init__(self):
+        self.routes = []
+        # Index of the group around every pattern in the joined one, to the route of the pattern
+        self._groups = {}
+        self._pattern = None
+
+    def add(self, pattern, callback, pass_groups=False, pass_chat_data=False, edited=False, stop=False):
+        """Calls callback(bot, update) for messages holding pattern, `edited` ones too if asked for
+
+        The groups of its first match and the chat_data are passed as keyword arguments if asked for, like
+        ptb's handlers do. With `stop`, routes added after this one don't see the messages it takes.
+        """
+        route = Route(re.compile(pattern), callback, pass_groups, pass_chat_data, edited, stop)
+        self.routes.append(route)
+
+        parts = []
+        self._groups = {}
+        group = 1
+        for each in self.routes:
+            parts.append(f'({each.pattern.pattern})')
+            self._groups[group] = each
+            group += each.pattern.groups + 1
+        self._pattern = re.compile('|'.join(parts))
+
+    def matches(self, text, edited=False):
+        """(route, groups) of the routes text is for, in the order they were added"""
+        found = {}
+        if self._pattern:
+            for match in self._pattern.finditer(text):
+                route = self._groups[match.lastindex]
+                if route not in found and (route.edited or not edited):
+                    found[route] = match.groups()[match.lastindex:match.lastindex + route.pattern.groups]
+                    if len(found) == len(self.routes):
+                        break
+        return sorted(found.items(), key=lambda item: self.routes.index(item[0]))
+
+    def route(self, bot, update, chat_data):
+        message = update.effective_message
+        for route, groups in self.matches(message.text, edited=bool(update.edited_message)):
+            kwargs = {}
+            if route.pass_groups:
+                kwargs['groups'] = groups
+            if route.pass_chat_data:
+                kwargs['chat_data'] = chat_data
+            route.callback(bot, update, **kwargs)
+            if route.stop:
+                break
+
+    def handler(self):
+        """The single handler for all routes, to be added after the commands"""
+        return MessageHandler(Filters.text, self.route, pass_chat_data=True, channel_post_updates=False,
+                              edited_updates=True)
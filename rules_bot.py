@@ -1,22 +1,25 @@
 import configparser
+import html
 import logging
 import os
 import re
-import time
-import json
-from functools import lru_cache
 
-from telegram import Bot, ParseMode, MessageEntity, ChatAction
+from telegram import Bot, ParseMode, ChatAction
 from telegram.error import BadRequest
-from telegram.ext import CommandHandler, RegexHandler, Updater, MessageHandler, Filters, run_async
+from telegram.ext import CommandHandler, Updater, Filters, run_async
 from telegram.utils.helpers import escape_markdown
 
 import const
+import metrics
+import webhook
+from router import Router
 from components import inlinequeries, taghints
-from const import ENCLOSED_REGEX, ENCLOSING_REPLACEMENT_CHARACTER, GITHUB_PATTERN, OFFTOPIC_CHAT_ID, OFFTOPIC_RULES, \
-    OFFTOPIC_USERNAME, ONTOPIC_RULES, ONTOPIC_USERNAME
+from const import DOCS_REFRESH_INTERVAL, ENCLOSED_REGEX, ENCLOSING_REPLACEMENT_CHARACTER, \
+    OFFTOPIC_CHAT_ID, OFFTOPIC_RULES, OFFTOPIC_USERNAME, ONTOPIC_RULES, ONTOPIC_USERNAME, REFERENCES_SAVE_INTERVAL, \
+    WORKERS
+from github import REFERENCE_HINT, find_references, references, resolve_all
 from search import search
-from util import ARROW_CHARACTER, DEFAULT_REPO, GITHUB_URL, get_reply_id, reply_or_edit, get_web_page_title, \
+from util import ARROW_CHARACTER, DEFAULT_REPO, GITHUB_URL, count_replies, get_reply_id, reply_or_edit, \
     get_text_not_in_entities
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
@@ -25,8 +28,11 @@ logger = logging.getLogger(__name__)
 
 self_chat_id = '@'  # Updated in main()
 
+errors = metrics.counter('errors_total', 'Updates whose handling raised an error')
+
 
 @run_async
+@metrics.timed('start')
 def start(bot, update, args=None):
     if args:
         if args[0] == 'inline-help':
@@ -37,6 +43,7 @@ def start(bot, update, args=None):
 
 
 @run_async
+@metrics.timed('inlinequery_help')
 def inlinequery_help(bot, update):
     chat_id = update.message.chat_id
     char = ENCLOSING_REPLACEMENT_CHARACTER
@@ -52,6 +59,7 @@ def inlinequery_help(bot, update):
 
 
 @run_async
+@metrics.timed('rules')
 def rules(bot, update):
     """Load and send the appropiate rules based on which group we're in"""
     if update.message.chat.username == ONTOPIC_USERNAME:
@@ -66,6 +74,7 @@ def rules(bot, update):
 
 
 @run_async
+@metrics.timed('docs')
 def docs(bot, update):
     """ Documentation link """
     text = "You can find our documentation at [Read the Docs](https://telethon.readthedocs.io/en/stable/)"
@@ -78,6 +87,7 @@ def docs(bot, update):
     update.message.delete()
 
 
+@metrics.timed('off_on_topic')
 def off_on_topic(bot, update, groups):
     chat_username = update.message.chat.username
     if chat_username == ONTOPIC_USERNAME and groups[0].lower() == 'off':
@@ -124,6 +134,7 @@ def off_on_topic(bot, update, groups):
 
 
 @run_async
+@metrics.timed('sandwich')
 def sandwich(bot, update, groups):
     if update.message.chat.username == OFFTOPIC_USERNAME:
         if 'sudo' in groups[0]:
@@ -133,78 +144,56 @@ def sandwich(bot, update, groups):
 
 
 @run_async
-def keep_typing(last, chat, action):
-    now = time.time()
-    if (now - last) > 1:
-        chat.send_action(action)
-    return now
-
-
-@run_async
-@lru_cache()
-def _get_github_title_and_type(url, sha=None):
-    title = get_web_page_title(url)
-    if not title:
-        return
-    split = title.split(' · ')
-    t = 'PR' if 'Pull Request' in split[1] else 'Issue'
-    if sha:
-        t = 'Commit'
-    return split[0], t
-
-
-@run_async
+@metrics.timed('github')
 def github(bot, update, chat_data):
     message = update.message or update.edited_message
-    last = 0
-    things = {}
+    wanted = {}
 
-    # Due to bug in ptb we need to convert entities of type URL to TEXT_LINK for them to be converted to html
-    for entity in message.entities:
-        if entity.type == MessageEntity.URL:
-            entity.type = MessageEntity.TEXT_LINK
-            entity.url = message.parse_entity(entity)
+    for user, repo, number, sha in find_references(get_text_not_in_entities(message)):
+        logging.debug(f'Reference {user}/{repo} #{number} @{sha}')
 
-    for match in GITHUB_PATTERN.finditer(get_text_not_in_entities(message.text_html)):
-        last = keep_typing(last, update.effective_chat, ChatAction.TYPING)
-        logging.debug(match.groupdict())
-
-        user, repo, number, sha = [match.groupdict()[x] for x in ('user', 'repo', 'number', 'sha')]
-        url = GITHUB_URL
+        full_repo = f'{user}/{repo}' if user and repo else DEFAULT_REPO
+        url = GITHUB_URL + full_repo
         name = ''
         if number:
             if user and repo:
-                url += f'{user}/{repo}'
-                name += f'{user}/{repo}'
-            else:
-                url += DEFAULT_REPO
+                name += full_repo
             name += f'#{number}'
             url += f'/issues/{number}'
         else:
             if user:
                 name += user
                 if repo:
-                    url += f'{user}/{repo}'
                     name += f'/{repo}'
                 name += '@'
-            if not repo:
-                url += DEFAULT_REPO
             name += sha[:7]
             url += f'/commit/{sha}'
 
-        if url in things.keys():
-            continue
+        if url not in wanted:
+            wanted[url] = (name, full_repo, number or sha, sha)
 
-        gh = _get_github_title_and_type(url, sha)
-        if not gh:
-            continue
+    if not wanted:
+        return
 
-        name = f'{gh[1]} {name}: {gh[0]}'
-        things[url] = name
+    # When the message was edited, only the references the reply doesn't have yet need to be looked up
+    reply = chat_data['replies'].get(message.message_id) if update.edited_message and 'replies' in chat_data else None
+    resolved = {url: gh for url, gh in reply.references.items() if url in wanted} if reply else {}
+    new = [(repo, ref, url, sha) for url, (name, repo, ref, sha) in wanted.items() if url not in resolved]
+    if new:
+        update.effective_chat.send_action(ChatAction.TYPING)
+        # All of them are looked up at once
+        resolved.update(resolve_all(new))
+
+    things = {}
+    for url, (name, repo, ref, sha) in wanted.items():
+        gh = resolved[url]
+        if gh:
+            things[url] = f'{gh[1]} {name}: {gh[0]}'
 
     if things:
         reply_or_edit(bot, update, chat_data,
-                      '\n'.join([f'[{name}]({url})' for url, name in things.items()]))
+                      '\n'.join([f'[{name}]({url})' for url, name in things.items()]),
+                      references={url: resolved[url] for url in things})
 
 
 def fuzzy_replacements_markdown(query, threshold=95):
@@ -216,11 +205,15 @@ def fuzzy_replacements_markdown(query, threshold=95):
 
     replacements = list()
     for s in symbols:
-        docs_res = search.docs(s, threshold=threshold)
-        if docs_res:
-            text = f'[{docs_res[0].short_name}]({docs_res[0].url})'
-
-            replacements.append((docs_res[0].short_name, s, text))
+        # Symbols are nearly always typed out in full, only the others need the fuzzy search
+        doc = search.symbol(s)
+        if doc is None:
+            docs_res = search.docs(s, threshold=threshold)
+            doc = docs_res[0] if docs_res else None
+        if doc:
+            text = f'[{doc.short_name}]({doc.url})'
+
+            replacements.append((doc.short_name, s, text))
             continue
 
         # not found
@@ -235,8 +228,45 @@ def fuzzy_replacements_markdown(query, threshold=95):
     return result_changed, result
 
 
+def refresh_docs(bot, job):
+    search.refresh()
+
+
+def save_references(bot, job):
+    references.save()
+
+
+@run_async
+def stats(bot, update):
+    """Runtime metrics, for the admins only"""
+    update.message.reply_text(f'<pre>{html.escape(metrics.summary())}</pre>', parse_mode=ParseMode.HTML)
+
+
+def add_routes(router):
+    """Routes the triggers in group messages to their handlers, see router.py"""
+    router.add(r'\#rules', rules)
+    router.add(r'(?i:((sudo )?make me a sandwich))', sandwich, pass_groups=True)
+    router.add(r'(?i:\b(?<!["\\])(off|on)[- _]?topic\b)', off_on_topic, pass_groups=True)
+    # Last, so that hashtags taken by the triggers above aren't mistaken for references
+    router.add(REFERENCE_HINT, github, pass_chat_data=True, edited=True)
+
+
+def register_metrics(dispatcher, api_index):
+    # The dispatcher's own thread pool has no public way of telling how much waits for it
+    async_queue = getattr(dispatcher, '_Dispatcher__async_queue', None)
+    metrics.register('queue_depth', 'Updates waiting for the dispatcher, and run_async calls waiting for a worker',
+                     lambda: {'updates': dispatcher.update_queue.qsize(),
+                              'run_async': async_queue.qsize() if async_queue else -1},
+                     label='queue')
+    metrics.register('replies', 'Replies remembered to be edited along with the message they answer',
+                     lambda: count_replies(dispatcher.chat_data))
+    # Searches made in worker processes use the workers' copies of it, which aren't counted here
+    metrics.register_cache('api_matches', lambda: api_index._matches)
+
+
 def error(bot, update, err):
     """Log all errors"""
+    errors.inc()
     logger.warning(f'Update "{update}" caused error "{err}"')
 
 
@@ -244,62 +274,67 @@ def main():
     config = configparser.ConfigParser()
     config.read('bot.ini')
 
-    updater = Updater(token=config['KEYS']['bot_api'])
+    # Handlers run on the dispatcher's worker threads, and ptb keeps a keep-alive connection to the Bot API
+    # for each of them besides those of the updater and the job queue
+    workers = config.getint('BOT', 'workers', fallback=WORKERS)
+    updater = Updater(token=config['KEYS']['bot_api'], workers=workers, request_kwargs={'con_pool_size': workers + 4})
     dispatcher = updater.dispatcher
 
     global SELF_CHAT_ID
     SELF_CHAT_ID = f'@{updater.bot.get_me().username}'
 
-    # dump requests list
-    with open('resources/search.json', 'r') as file:
-        main_list = json.load(file)
-        requests_list = [each['value'] for each in
-                         main_list['body'][13]['block']['body'][0]['expression']['right']['elements']]
-        types_list = [each['value'] for each in
-                      main_list['body'][13]['block']['body'][1]['expression']['right']['elements']]
-        constructors_list = [each['value'] for each in
-                             main_list['body'][13]['block']['body'][2]['expression']['right']['elements']]
-        requests_u_list = [each['value'] for each in
-                           main_list['body'][13]['block']['body'][3]['expression']['right']['elements']]
-        types_u_list = [each['value'] for each in
-                        main_list['body'][13]['block']['body'][4]['expression']['right']['elements']]
-        constructors_u_list = [each['value'] for each in
-                               main_list['body'][13]['block']['body'][5]['expression']['right']['elements']]
-        all_list = {"Method": (requests_list, requests_u_list),
-                    "Type": (types_list, types_u_list),
-                    "Constructor": (constructors_list, constructors_u_list)}
+    # Serve the cached inventory right away and pick up newer ones from the job queue thread
+    updater.job_queue.run_repeating(refresh_docs, interval=DOCS_REFRESH_INTERVAL, first=0)
+
+    # Start with the GitHub titles resolved before the last restart
+    references.load()
+    updater.job_queue.run_repeating(save_references, interval=REFERENCES_SAVE_INTERVAL)
+
+    api_index = search.api_index
+
+    # Searching is pure Python, in processes of their own searches don't hold up the other handlers
+    processes = config.getint('SEARCH', 'processes', fallback=0)
+    if processes:
+        search.start_workers(processes)
+
+    # Telegram user ids allowed to use /stats
+    admins = [int(admin) for admin in config.get('BOT', 'admins', fallback='').replace(',', ' ').split()]
 
     start_handler = CommandHandler('start', start, pass_args=True)
     rules_handler = CommandHandler('rules', rules)
-    rules_handler_hashtag = RegexHandler(r'.*#rules.*', rules)
     docs_handler = CommandHandler('docs', docs, allow_edited=True)
-    sandwich_handler = RegexHandler(r'(?i)[\s\S]*?((sudo )?make me a sandwich)[\s\S]*?', sandwich,
-                                    pass_groups=True)
-    off_on_topic_handler = RegexHandler(r'(?i)[\s\S]*?\b(?<!["\\])(off|on)[- _]?topic\b',
-                                        off_on_topic,
-                                        pass_groups=True)
-
-    # We need several matches so RegexHandler is basically useless
-    # therefore we catch everything and do regex ourselves
-    # This should probably be in another dispatcher group
-    # but I kept getting SystemErrors...
-    github_handler = MessageHandler(Filters.all, github, allow_edited=True, pass_chat_data=True)
+
+    # Hashtags and other triggers in messages, all found in one scan of the text and all answered
+    router = Router()
+    taghints.add_routes(router)
+    add_routes(router)
 
     taghints.register(dispatcher)
+
     dispatcher.add_handler(start_handler)
     dispatcher.add_handler(rules_handler)
-    dispatcher.add_handler(rules_handler_hashtag)
     dispatcher.add_handler(docs_handler)
-    dispatcher.add_handler(sandwich_handler)
-    dispatcher.add_handler(off_on_topic_handler)
-    dispatcher.add_handler(github_handler)
+    if admins:
+        dispatcher.add_handler(CommandHandler('stats', stats, filters=Filters.user(user_id=admins)))
+    # Takes any text, so it comes after the commands
+    dispatcher.add_handler(router.handler())
 
-    inlinequeries.register(dispatcher, all_list)
+    inlinequeries.register(dispatcher, api_index)
     dispatcher.add_error_handler(error)
 
-    updater.start_polling(clean=True)
+    register_metrics(dispatcher, api_index)
+    metrics_server = metrics.serve(config) if config.has_section('METRICS') else None
+
+    if config.has_section('WEBHOOK'):
+        webhook.start_webhook(updater, config)
+    else:
+        updater.start_polling(clean=True)
     logger.info('Listening...')
     updater.idle()
+    references.save()
+    search.stop_workers()
+    if metrics_server:
+        metrics_server.shutdown()
 
 
 if __name__ == '__main__':
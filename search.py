@@ -1,121 +1,315 @@
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
 from collections import namedtuple
+from multiprocessing import forkserver
+from heapq import heappush, heapreplace
+from http.client import HTTPException
+from io import BytesIO
 from urllib.parse import urljoin
-from urllib.request import urlopen
 
-from fuzzywuzzy import fuzz
-from sphinx.util.inventory import InventoryFile
-
-from util import DEFAULT_REPO, GITHUB_URL
+import metrics
+from apicatalog import ApiIndex, load_catalog
+from const import CACHE_DIR
+from docsindex import DocsIndex
+from inventory import read_inventory
+from util import DEFAULT_REPO, GITHUB_URL, connections
 
 DOCS_URL = "https://telethon.readthedocs.io/en/latest/"
 API_URL = "https://lonamiwebs.github.io/Telethon/"
 PROJECT_URL = urljoin(GITHUB_URL, DEFAULT_REPO + '/')
+INVENTORY_CACHE = os.path.join(CACHE_DIR, 'objects.inv')
+# Seconds a search worker gets to answer before the search is made in this process instead
+WORKER_TIMEOUT = 10
+
+logger = logging.getLogger(__name__)
 
 Doc = namedtuple('Doc', 'short_name, full_name, type, url')
 
 
 class BestHandler:
-    def __init__(self):
+    """Keeps the `amount` best scoring items above `threshold`"""
+
+    def __init__(self, amount, threshold):
+        self.amount = amount
+        self.threshold = threshold
         self.items = []
+        self.added = 0
 
     def add(self, score, item):
-        self.items.append((score, item))
+        if score <= self.threshold or self.amount < 1:
+            return False
+        if len(self.items) == self.amount and score <= self.items[0][0]:
+            return False
 
-    def to_list(self, amount, threshold):
-        items = sorted(self.items, key=lambda x: x[0])
-        items = [item for score, item in reversed(items[-amount:]) if score > threshold]
+        # On equal scores the item added first ranks higher
+        self.added += 1
+        entry = (score, -self.added, item)
+        if len(self.items) < self.amount:
+            heappush(self.items, entry)
+        else:
+            heapreplace(self.items, entry)
+        return True
+
+    def to_list(self):
+        items = [item for score, _, item in sorted(self.items, reverse=True)]
         return items if len(items) > 0 else None
 
 
 class Search:
-    def __init__(self):
-        self._docs = {}
-        self.parse_docs()
+    def __init__(self, cache_path=INVENTORY_CACHE):
+        # The index searched, and the worker processes searching the same inventory if there are any, replaced
+        # together so that a search never uses one with the other's inventory
+        self._current = (DocsIndex({}), None)
+        self._cache_path = cache_path
+        # Modification time and size of the cache file the index was read from or saved to
+        self._version = None
+        # When the inventory was last revalidated, and how long that took
+        self.last_refresh = None
+        self.last_refresh_duration = None
+        # ETag and Last-Modified of the cached inventory, sent back to only download it when it changed
+        self._validators = {}
+        # Worker processes searching instead of the handler threads, see start_workers
+        self._processes = 0
+        # Version of the cached inventory the fork server read when it started, workers come with its index
+        self._server_version = None
+        # The API catalogue workers search, see api_docs
+        self.api_index = None
+        self.load_cache()
+
+    @property
+    def _index(self):
+        return self._current[0]
+
+    def load_cache(self):
+        """Serve the inventory saved by the last download, if there is one"""
+        try:
+            version = _file_version(self._cache_path)
+            with open(self._cache_path, 'rb') as file:
+                index = DocsIndex(read_inventory(file, DOCS_URL))
+            self._version = version
+            self._publish(index)
+            with open(self._cache_path + '.json') as file:
+                self._validators = json.load(file)
+        except FileNotFoundError:
+            logger.info('No cached documentation inventory yet')
+        except Exception:
+            logger.exception('Could not load the cached documentation inventory')
 
     def parse_docs(self):
-        docs_data = urlopen(urljoin(DOCS_URL, "objects.inv"))
-        self._docs = InventoryFile.load(docs_data, DOCS_URL, urljoin)
+        """Download the inventory if it changed since it was cached, returns whether it did"""
+        headers = {}
+        if 'ETag' in self._validators:
+            headers['If-None-Match'] = self._validators['ETag']
+        if 'Last-Modified' in self._validators:
+            headers['If-Modified-Since'] = self._validators['Last-Modified']
+
+        with connections.open(urljoin(DOCS_URL, "objects.inv"), headers, timeout=30) as response:
+            docs_data = response.read()
+            if response.status == 304:
+                return False
+            if response.status != 200:
+                raise HTTPException(f'{response.status} {response.reason} for the documentation inventory')
+            validators = {k: response.getheader(k) for k in ('ETag', 'Last-Modified') if response.getheader(k)}
+
+        # Saved before it's published, workers read it from the cache
+        index = DocsIndex(read_inventory(BytesIO(docs_data), DOCS_URL))
+        self._validators = validators
+        self.save_cache(docs_data)
+        self._publish(index)
+        return True
+
+    def save_cache(self, docs_data):
+        os.makedirs(os.path.dirname(self._cache_path) or '.', exist_ok=True)
+        # Write aside and rename, so a crash never leaves a truncated inventory behind
+        for path, data in ((self._cache_path, docs_data),
+                           (self._cache_path + '.json', json.dumps(self._validators).encode())):
+            with open(path + '.tmp', 'wb') as file:
+                file.write(data)
+            os.replace(path + '.tmp', path)
+        self._version = _file_version(self._cache_path)
+
+    @metrics.timed('search.refresh')
+    def refresh(self):
+        """Revalidate the inventory and rebuild the index when it changed, meant to run off the request path"""
+        start = time.perf_counter()
+        try:
+            changed = self.parse_docs()
+        except Exception:
+            logger.exception('Could not refresh the documentation inventory')
+            return
+
+        self.last_refresh = time.time()
+        self.last_refresh_duration = time.perf_counter() - start
+        if changed:
+            logger.info(f'Loaded {len(self._index)} documentation entries from {DOCS_URL} '
+                        f'in {self.last_refresh_duration:.2f}s')
+
+    def load_docs(self, docs_data):
+        """Searches the inventory read from the file docs_data from now on
+
+        Workers read theirs from the cache, so while they run only the cached one should be loaded.
+        """
+        self._publish(DocsIndex(read_inventory(docs_data, DOCS_URL)))
+
+    def _publish(self, index):
+        # Everything derived from the inventory is built aside and published with a single assignment,
+        # so searches running meanwhile keep using the index and workers they started with
+        old = self._current[1]
+        if self._processes and self._server_version != self._version:
+            # Workers come with the index of the fork server, which only reads the cached inventory when it
+            # starts, and which only stops after its last worker. Meanwhile this process searches the new index
+            self._current = (index, None)
+            if old:
+                old.close()
+                old.join()
+                old = None
+            forkserver._forkserver._stop()
+            self._server_version = self._version
+        pool = self._new_pool() if self._processes else None
+        self._current = (index, pool)
+        if old:
+            # Searches already handed to the old workers are still answered
+            old.close()
+            threading.Thread(target=old.join, name='search-pool-join', daemon=True).start()
+
+    def start_workers(self, processes):
+        """Searches in `processes` worker processes from now on, so searches don't hold up the handler threads
+
+        The workers are forked from a server process holding the index of the cached inventory and the API
+        catalogue, and share them with it instead of each making its own. Whenever a new inventory is loaded,
+        a new server reads it and new workers are forked from that one.
+        """
+        self._processes = processes
+        self._publish(self._index)
+
+    def stop_workers(self):
+        self._processes = 0
+        index, pool = self._current
+        self._current = (index, None)
+        if pool:
+            pool.terminate()
+
+    def _new_pool(self):
+        context = multiprocessing.get_context('forkserver')
+        # Workers are forked from a server process that only imported the main module and this one, and with it
+        # the cached inventory, instead of from the bot whose threads may hold locks the workers would inherit
+        context.set_forkserver_preload(['__main__', 'search'])
+        pool = context.Pool(self._processes, _init_worker, (self._cache_path, self._version))
+        # Tasks only run once a worker has read the inventory, so searches never wait for that
+        pool.apply(os.getpid)
+        logger.info(f'Searching in {self._processes} worker processes')
+        return pool
+
+    @staticmethod
+    def _run(pool, function, shared, *args):
+        """function(shared, *args), in a worker of pool if there is one and in this process otherwise
 
-    def docs(self, query, amount=3, threshold=80):
+        Workers get None for shared, which would be copied to them otherwise, and use the one they inherited.
+        """
+        if pool:
+            try:
+                return pool.apply_async(function, (None,) + args).get(WORKER_TIMEOUT)
+            except Exception:
+                logger.exception('Search worker failed, searching in this process instead')
+        return function(shared, *args)
+
+    @metrics.timed('search.docs')
+    def docs(self, query, amount=3, threshold=80, exhaustive=False):
+        index, pool = self._current
+        key = (query, amount, threshold, exhaustive)
+        cached = index.results.get(key, False)
+        if cached is not False:
+            return cached
+
+        result = self._run(pool, _docs, index, query, amount, threshold, exhaustive)
+        index.results.set(key, result)
+        return result
+
+    def _docs(self, index, query, amount, threshold, exhaustive):
         query = list(reversed(query.split('.')))
-        besth = BestHandler()
-        best = (0, None)
-
-        for typ, items in self._docs.items():
-            if typ not in ['py:staticmethod', 'py:exception', 'py:method', 'py:module', 'py:class', 'py:attribute',
-                           'py:data', 'py:function']:
-                continue
-            for name, item in items.items():
-                name_bits = name.split('.')
-                dot_split = zip(query, reversed(name_bits))
-                score = 0
-                for s, n in dot_split:
-                    score += fuzz.ratio(s, n)
-                score += fuzz.ratio(query, name)
-
-                # These values are basically random :/
-                if typ == 'py:module':
-                    score *= 0.75
-                if typ == 'py:class':
-                    score *= 1.10
-                if typ == 'py:attribute':
-                    score *= 0.85
-
-                if score > best[0]:
-                    short_name = name_bits[1:]
-
-                    try:
-                        if name_bits[1].lower() == name_bits[2].lower():
-                            short_name = name_bits[2:]
-                    except IndexError:
-                        pass
-                    best = (score, Doc('.'.join(short_name), name, typ[3:], item[2]))
-                    besth.add(score, Doc('.'.join(short_name), name, typ[3:], item[2]))
-
-        return besth.to_list(amount, threshold)
-
-    def api_docs(self, query, all_list):
-        result_list = []
-
-        for key, value in all_list.items():
-            res = self.get_search_array(value[0], value[1], query)[:10]
-            for i, des in enumerate(res[0]):
-                result_list.append(Doc(des, des, key, f"{API_URL}{res[1][i]}"))
-
-        return result_list
-
-    def get_search_array(self, origins, originus, query):
-        destination = []
-        destinationu = []
-
-        for i, origin in enumerate(origins):
-            if self.find(origin.lower(), query):
-                destination.append(origin)
-                destinationu.append(originus[i])
-
-        return [destination, destinationu]
+        besth = BestHandler(amount, threshold)
+
+        # Only the entries sharing the most trigrams with the query are scored, unless asked not to
+        candidates = range(len(index)) if exhaustive else index.candidates(query)
+
+        for position, score in zip(candidates, index.score(query, candidates)):
+            besth.add(score, position)
+
+        best = besth.to_list()
+        if not best:
+            return None
+        return [self._doc(index, position) for position in best]
 
     @staticmethod
-    def find(haystack, needle):
-        if len(needle) == 0:
-            return True
-        hi = 0
-        ni = 0
-        while True:
-            while ord(needle[ni]) < ord('a') or ord(needle[ni]) > ord('z'):
-                ni += 1
-                if ni == len(needle):
-                    return True
-            while haystack[hi] != needle[ni]:
-                hi += 1
-                if hi == len(haystack):
-                    return False
-            hi += 1
-            ni += 1
-            if ni == len(needle):
-                return True
-            if hi == len(haystack):
-                return False
+    def _doc(index, position):
+        name = index.names[position]
+        name_bits = name.split('.')
+        short_name = name_bits[1:]
+
+        try:
+            if name_bits[1].lower() == name_bits[2].lower():
+                short_name = name_bits[2:]
+        except IndexError:
+            pass
+        return Doc('.'.join(short_name), name, index.type(position)[3:], index.url(position))
+
+    def symbol(self, name):
+        """The Doc a dotted name like `TelegramClient` or `events.NewMessage` ends, the one the fuzzy search
+        ranks first if it ends several, or None if it ends none as it is written"""
+        index = self._index
+        position = index.symbol(name)
+        return None if position is None else self._doc(index, position)
+
+    @metrics.timed('search.api_docs')
+    def api_docs(self, query, api_index, amount=10):
+        # Workers only have the catalogue of the module's search
+        if api_index is not self.api_index:
+            return self._api_docs(api_index, query, amount)
+        return self._run(self._current[1], _api_docs, api_index, query, amount)
+
+    @staticmethod
+    def _api_docs(api_index, query, amount):
+        return [Doc(name, name, category, f"{API_URL}{url}")
+                for category, name, url in api_index.search(query, amount)]
+
+
+def _init_worker(cache_path, version):
+    # Ctrl+C is for the bot, which stops the workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Workers come with the index of the bot's cache as the fork server read it. Only when it changed since,
+    # or workers search another one, each reads it again
+    if search._cache_path != cache_path or search._version != version:
+        search._cache_path = cache_path
+        search.load_cache()
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def _docs(index, query, amount, threshold, exhaustive):
+    return search._docs(search._index if index is None else index, query, amount, threshold, exhaustive)
+
+
+def _api_docs(api_index, query, amount):
+    return search._api_docs(search.api_index if api_index is None else api_index, query, amount)
 
 
 search = Search()
+# Precompiled from resources/search.json, see apicatalog.py. Made on import, worker processes inherit it
+search.api_index = ApiIndex(load_catalog())
+# The index, and the results cached with it, are replaced whenever the inventory changes
+metrics.register_cache('docs_results', lambda: search._index.results)
+metrics.register('docs_last_refresh_timestamp', 'Unix time the documentation inventory was last revalidated, 0 before',
+                 lambda: search.last_refresh or 0)
+metrics.register('docs_last_refresh_seconds', 'Seconds the last revalidation of the documentation inventory took',
+                 lambda: search.last_refresh_duration or 0)
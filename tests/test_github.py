@@ -0,0 +1,56 @@
+"""The GitHub references cache read back from its file
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import json
+import time
+
+import pytest
+
+import github
+
+
+def load(tmp_path, entries):
+    path = tmp_path / 'references.json'
+    path.write_text(json.dumps(entries))
+    cache = github.ReferenceCache(str(path))
+    cache.load()
+    return cache
+
+
+def test_saved_references_load_back(tmp_path):
+    cache = github.ReferenceCache(str(tmp_path / 'references.json'))
+    cache.set(('lonamiwebs/telethon', '12'), ('Thing number 12', 'Issue'))
+    cache.set(('lonamiwebs/telethon', '20'), None)
+    cache.save()
+
+    loaded = github.ReferenceCache(cache.path)
+    loaded.load()
+    assert loaded.get(('lonamiwebs/telethon', '12')) == ('Thing number 12', 'Issue')
+    assert loaded.get(('lonamiwebs/telethon', '20'), 'unknown') is None
+
+
+@pytest.mark.parametrize('entries', [{}, 'references', 12, None])
+def test_file_of_another_shape_is_ignored(tmp_path, entries):
+    assert len(load(tmp_path, entries)) == 0
+
+
+def test_malformed_rows_are_skipped(tmp_path):
+    later = time.time() + 60
+    cache = load(tmp_path, [
+        ['lonamiwebs/telethon', '12', ['Thing number 12', 'Issue'], later],
+        ['lonamiwebs/telethon', '13', ['Thing number 13', 'Issue']],
+        ['lonamiwebs/telethon', '14', ['Thing number 14'], later],
+        ['lonamiwebs/telethon', '15', ['Thing number 15', 'PR'], 'later'],
+        {'repo': 'lonamiwebs/telethon'},
+        None,
+        ['lonamiwebs/telethon', '16', None, later],
+    ])
+    assert len(cache) == 2
+    assert cache.get(('lonamiwebs/telethon', '12')) == ('Thing number 12', 'Issue')
+    assert cache.get(('lonamiwebs/telethon', '16'), 'unknown') is None
+
+
+def test_expired_rows_are_dropped(tmp_path):
+    cache = load(tmp_path, [['lonamiwebs/telethon', '12', ['Thing number 12', 'Issue'], time.time() - 1]])
+    assert len(cache) == 0
@@ -0,0 +1,134 @@
+"""GitHub title lookups and the inventory revalidation against a local stand-in
+
+Run from the repository root with `python -m pytest tests`.
+"""
+import threading
+import time
+
+import pytest
+
+import github
+import search as search_module
+from benchmarks.replay import StandIn, StandInServer, synthetic_inventory
+
+ETAG = '"inventory-1"'
+# The stand-in's answer to a lookup takes this long, resolving several at once shouldn't take much longer
+LATENCY = 0.3
+# Bytes of the page that never seems to end, and the seconds it waits between the pieces it sends
+ENDLESS_SIZE = 64 * 1024 * 1024
+ENDLESS_DELAY = 0.05
+
+
+class CheckStandIn(StandIn):
+    """The replay stand-in, besides redirecting issues ending in 5 to pull requests like GitHub does, answering
+    conditional requests for the inventory, and serving a page whose body takes forever after its title
+
+    The If-None-Match of every inventory request, and the client port of every request, are recorded.
+    """
+    inventory = synthetic_inventory()
+    inventory_requests = []
+    ports = []
+
+    def do_GET(self):
+        CheckStandIn.ports.append(self.client_address[1])
+        parts = self.path.strip('/').split('/')
+        if self.path.endswith('/objects.inv'):
+            CheckStandIn.inventory_requests.append(self.headers.get('If-None-Match'))
+            if self.headers.get('If-None-Match') == ETAG:
+                self.send_response(304)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('ETag', ETAG)
+            self.send_header('Content-Length', str(len(self.inventory)))
+            self.end_headers()
+            self.wfile.write(self.inventory)
+            return
+        if len(parts) == 4 and parts[2] == 'issues' and parts[3].endswith('5'):
+            self.send_response(301)
+            self.send_header('Location', f'/{parts[0]}/{parts[1]}/pull/{parts[3]}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if parts == ['endless']:
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(ENDLESS_SIZE))
+            self.end_headers()
+            head = b'<html><head><title>Endless &amp; slow</title></head><body>'
+            self.wfile.write(head)
+            for _ in range((ENDLESS_SIZE - len(head)) // 65536):
+                time.sleep(ENDLESS_DELAY)
+                self.wfile.write(b'x' * 65536)
+            return
+        super().do_GET()
+
+
+@pytest.fixture(scope='module')
+def base_url():
+    server = StandInServer(('127.0.0.1', 0), CheckStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/'
+    server.shutdown()
+
+
+def test_issue_title(base_url):
+    assert github.get_title_and_type(base_url + 'LonamiWebs/Telethon/issues/12') == ('Thing number 12', 'Issue')
+
+
+def test_issue_redirected_to_its_pull_request(base_url):
+    assert github.get_title_and_type(base_url + 'LonamiWebs/Telethon/issues/15') == ('Thing number 15', 'PR')
+
+
+def test_page_not_found(base_url):
+    assert github.get_title_and_type(base_url + 'LonamiWebs/Telethon/issues/20') is None
+
+
+def test_page_read_only_up_to_title(base_url):
+    start = time.perf_counter()
+    assert github.get_page_title(base_url + 'endless') == 'Endless & slow'
+    assert time.perf_counter() - start < 1
+
+
+def test_connection_of_small_page_kept(base_url):
+    github.get_page_title(base_url + 'LonamiWebs/Telethon/issues/13')
+    github.get_page_title(base_url + 'LonamiWebs/Telethon/issues/14')
+    assert CheckStandIn.ports[-1] == CheckStandIn.ports[-2]
+
+
+def test_connection_of_long_page_closed(base_url):
+    github.get_page_title(base_url + 'LonamiWebs/Telethon/issues/13')
+    # Takes the connection kept after the small page, and closes it
+    github.get_page_title(base_url + 'endless')
+    github.get_page_title(base_url + 'LonamiWebs/Telethon/issues/14')
+    assert CheckStandIn.ports[-2] == CheckStandIn.ports[-3]
+    assert CheckStandIn.ports[-1] != CheckStandIn.ports[-2]
+
+
+def test_inventory_revalidation(base_url, monkeypatch, tmp_path):
+    monkeypatch.setattr(search_module, 'DOCS_URL', base_url + 'docs/')
+    cache_path = str(tmp_path / 'objects.inv')
+    searcher = search_module.Search(cache_path)
+    assert searcher.parse_docs() is True
+    found = searcher.docs('Message')
+    assert found
+
+    assert searcher.parse_docs() is False
+    assert CheckStandIn.inventory_requests[-1] == ETAG
+
+    # After a restart the cache is served, and revalidated the same way
+    restarted = search_module.Search(cache_path)
+    assert restarted.docs('Message') == found
+    assert restarted.parse_docs() is False
+
+
+def test_references_resolved_concurrently(base_url, monkeypatch):
+    monkeypatch.setattr(github, 'references', github.ReferenceCache())
+    monkeypatch.setattr(CheckStandIn, 'latency', LATENCY)
+    wanted = [('LonamiWebs/Telethon', str(number), f'{base_url}LonamiWebs/Telethon/issues/{number}', None)
+              for number in (31, 32, 33, 34, 36)]
+    start = time.perf_counter()
+    resolved = github.resolve_all(wanted)
+    assert sum(map(bool, resolved.values())) == 5
+    assert time.perf_counter() - start < LATENCY * 2
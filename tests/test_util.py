@@ -0,0 +1,53 @@
+"""Replying to messages, and to their edits
+
+Run from the repository root with `python -m pytest tests`.
+"""
+from datetime import datetime, timedelta
+
+from telegram import Chat, Message, Update
+
+import util
+
+
+class FakeBot:
+    """Records the messages sent and edited"""
+
+    def __init__(self):
+        self.sent = []
+        self.edited = []
+
+    def send_message(self, chat_id, text, **kwargs):
+        self.sent.append(text)
+        return Message(len(self.sent) + 1000, None, datetime.now(), Chat(chat_id, 'supergroup'), text=text)
+
+    sendMessage = send_message
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.edited.append((message_id, text))
+
+
+def update(bot, edited=False, age=timedelta()):
+    message = Message(1, None, datetime.now() - age, Chat(-1001, 'supergroup'), text='#12', bot=bot)
+    return Update(1, edited_message=message) if edited else Update(1, message=message)
+
+
+def test_edit_changes_the_reply():
+    bot, chat_data = FakeBot(), {}
+    util.reply_or_edit(bot, update(bot), chat_data, 'first')
+    util.reply_or_edit(bot, update(bot, edited=True), chat_data, 'second')
+    assert bot.sent == ['first']
+    assert bot.edited == [(1001, 'second')]
+
+
+def test_recent_edit_without_reply_gets_one():
+    bot = FakeBot()
+    util.reply_or_edit(bot, update(bot, edited=True, age=timedelta(hours=1)), {}, 'first')
+    assert bot.sent == ['first']
+
+
+def test_old_edit_without_reply_gets_none():
+    bot = FakeBot()
+    age = timedelta(seconds=util.REPLY_EDIT_WINDOW + 60)
+    util.reply_or_edit(bot, update(bot, edited=True, age=age), {}, 'first')
+    assert bot.sent == []
+    assert bot.edited == []
@@ -1,13 +1,204 @@
-from urllib.error import HTTPError
-from urllib.request import urlopen
+import http.client
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from urllib.parse import urljoin, urlsplit, urlunsplit
 
-from bs4 import BeautifulSoup
-
-from telegram import ParseMode
+from telegram import MessageEntity, ParseMode
+from telegram.utils.helpers import to_timestamp
 
 ARROW_CHARACTER = '➜'
 GITHUB_URL = "https://github.com/"
 DEFAULT_REPO = 'LonamiWebs/Telethon'
+# Replies are remembered for as long as Telegram lets the bot edit them
+REPLY_EDIT_WINDOW = 48 * 60 * 60
+REPLIES_PER_CHAT = 1000
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+# Responses left with at most this many bytes unread, as told by their Content-Length, are read to the end on
+# release so their connection can be kept. Reading more costs more than opening a new connection
+MAX_DRAIN_BYTES = 64 * 1024
+
+
+class TTLCache:
+    """Mapping of at most `maxsize` entries, dropping the least recently used ones and those older than `ttl`"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires < time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def items(self):
+        """(key, value, seconds left) of the live entries, least recently used first"""
+        now = time.monotonic()
+        with self._lock:
+            return [(key, value, expires - now) for key, (expires, value) in self._data.items() if expires > now]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+Reply = namedtuple('Reply', 'chat_id, message_id, text, references')
+
+
+class ReplyStore:
+    """The bot's replies by the id of the message they answer, oldest dropped first
+
+    Besides what is needed to edit it, a reply keeps its text and the GitHub references it was made of.
+    """
+
+    def __init__(self, maxsize=REPLIES_PER_CHAT, ttl=REPLY_EDIT_WINDOW):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        # All entries live equally long, so insertion order is expiry order
+        self._replies = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, message_id):
+        """The Reply to message_id, or None"""
+        with self._lock:
+            self._expire()
+            entry = self._replies.get(message_id)
+            return entry[1] if entry else None
+
+    def set(self, message_id, reply):
+        with self._lock:
+            self._replies.pop(message_id, None)
+            self._replies[message_id] = (time.monotonic() + self.ttl, reply)
+            self._expire()
+            while len(self._replies) > self.maxsize:
+                self._replies.popitem(last=False)
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._replies and next(iter(self._replies.values()))[0] < now:
+            self._replies.popitem(last=False)
+
+    def __len__(self):
+        with self._lock:
+            self._expire()
+            return len(self._replies)
+
+
+def count_replies(chat_data):
+    """Replies remembered over all chats, given the chat_data of the dispatcher"""
+    return sum(len(data['replies']) for data in list(chat_data.values()) if 'replies' in data)
+
+
+class ConnectionPool:
+    """Idle keep-alive HTTP(S) connections per host, shared by all threads making requests
+
+    A connection is only kept when its response was read to the end, or is short enough to be, see `release`.
+    """
+
+    def __init__(self, timeout=10, maxsize=8):
+        self.timeout = timeout
+        self.maxsize = maxsize
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def request(self, method, url, headers=None, timeout=None):
+        """Sends a request over a pooled connection and returns (connection, response)
+
+        Hand both to `release` once done with the response.
+        """
+        parts = urlsplit(url)
+        path = urlunsplit(('', '', parts.path or '/', parts.query, ''))
+        while True:
+            connection, reused = self._connection(parts.scheme, parts.netloc)
+            connection.timeout = self.timeout if timeout is None else timeout
+            if connection.sock:
+                connection.sock.settimeout(connection.timeout)
+            try:
+                connection.request(method, path, headers=headers or {})
+                return connection, connection.getresponse()
+            except (ConnectionError, http.client.HTTPException):
+                connection.close()
+                # The server may have closed an idle connection in the meantime, try again on a new one
+                if not reused:
+                    raise
+            except Exception:
+                connection.close()
+                raise
+
+    @contextmanager
+    def open(self, url, headers=None, timeout=None, max_redirects=3):
+        """GETs url following redirects, the final response is released when the block is left"""
+        for _ in range(max_redirects + 1):
+            connection, response = self.request('GET', url, headers, timeout)
+            location = response.getheader('Location')
+            if response.status not in REDIRECT_STATUSES or not location:
+                try:
+                    yield response
+                finally:
+                    self.release(url, connection, response)
+                return
+            response.read()
+            self.release(url, connection, response)
+            url = urljoin(url, location)
+        raise http.client.HTTPException(f'Too many redirects, last to {url}')
+
+    def release(self, url, connection, response):
+        """Keeps the connection for later if the response was or can cheaply be read to the end, closes it otherwise"""
+        if (not response.isclosed() and not response.will_close and response.length is not None
+                and response.length <= MAX_DRAIN_BYTES):
+            try:
+                response.read()
+            except Exception:
+                connection.close()
+                return
+        if response.isclosed() and not response.will_close:
+            parts = urlsplit(url)
+            with self._lock:
+                idle = self._idle.setdefault((parts.scheme, parts.netloc), [])
+                if len(idle) < self.maxsize:
+                    idle.append(connection)
+                    return
+        connection.close()
+
+    def _connection(self, scheme, netloc):
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                return idle.pop(), True
+        if scheme == 'https':
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout), False
+        return http.client.HTTPConnection(netloc, timeout=self.timeout), False
+
+
+# Used by everything talking to the web besides the Bot API, which ptb pools itself. The inventory
+# revalidation keeps its connection, a GitHub lookup only when it was redirected or the page wasn't found,
+# see github.get_page_title
+connections = ConnectionPool()
 
 
 def get_reply_id(update):
@@ -16,35 +207,55 @@ def get_reply_id(update):
     return None
 
 
-def reply_or_edit(bot, update, chat_data, text):
+def reply_or_edit(bot, update, chat_data, text, references=None):
+    """Replies with text, or edits the earlier reply if the message was edited and the text changed"""
+    replies = chat_data.setdefault('replies', ReplyStore())
+    message = update.effective_message
     if update.edited_message:
-        chat_data[update.edited_message.message_id].edit_text(text,
-                                                              parse_mode=ParseMode.MARKDOWN,
-                                                              disable_web_page_preview=True)
+        reply = replies.get(message.message_id)
+        if reply:
+            if text != reply.text:
+                bot.edit_message_text(text, chat_id=reply.chat_id, message_id=reply.message_id,
+                                      parse_mode=ParseMode.MARKDOWN, disable_web_page_preview=True)
+                replies.set(message.message_id, reply._replace(text=text, references=references or {}))
+            return
+        # A reply to a message this old may have been forgotten already, better none than a second one
+        if time.time() - to_timestamp(message.date) > REPLY_EDIT_WINDOW:
+            return
+
+    # New messages, and recent edited ones that had no reply yet, get a new one
+    issued_reply = get_reply_id(update)
+    if issued_reply:
+        sent = bot.sendMessage(message.chat_id, text,
+                               reply_to_message_id=issued_reply,
+                               parse_mode=ParseMode.MARKDOWN,
+                               disable_web_page_preview=True)
     else:
-        issued_reply = get_reply_id(update)
-        if issued_reply:
-            chat_data[update.message.message_id] = bot.sendMessage(update.message.chat_id, text,
-                                                                   reply_to_message_id=issued_reply,
-                                                                   parse_mode=ParseMode.MARKDOWN,
-                                                                   disable_web_page_preview=True)
-        else:
-            chat_data[update.message.message_id] = update.message.reply_text(text,
-                                                                             parse_mode=ParseMode.MARKDOWN,
-                                                                             disable_web_page_preview=True)
-
-
-def get_web_page_title(url):
-    try:
-        soup = BeautifulSoup(urlopen(url), "html.parser")
-        return soup.title.string
-    except HTTPError:
-        return None
-
-
-def get_text_not_in_entities(html):
-    soup = BeautifulSoup(html, 'html.parser')
-    return ' '.join(soup.find_all(text=True, recursive=False))
+        sent = message.reply_text(text,
+                                  parse_mode=ParseMode.MARKDOWN,
+                                  disable_web_page_preview=True)
+    replies.set(message.message_id, Reply(sent.chat_id, sent.message_id, text, references or {}))
+
+
+# Entities whose text is formatted or linked already, references in them are meant to stay as they are
+FORMATTED_ENTITIES = (MessageEntity.BOLD, MessageEntity.ITALIC, MessageEntity.CODE, MessageEntity.PRE,
+                      MessageEntity.URL, MessageEntity.TEXT_LINK, MessageEntity.TEXT_MENTION)
+
+
+def get_text_not_in_entities(message):
+    """The pieces of the message text outside formatted entities, joined by spaces"""
+    # Entity offsets and lengths count UTF-16 code units
+    text = message.text.encode('utf-16-le')
+    pieces = []
+    last = 0
+    for entity in sorted(message.entities, key=lambda e: e.offset):
+        if entity.type not in FORMATTED_ENTITIES:
+            continue
+        if entity.offset * 2 > last:
+            pieces.append(text[last:entity.offset * 2].decode('utf-16-le'))
+        last = max(last, (entity.offset + entity.length) * 2)
+    pieces.append(text[last:].decode('utf-16-le'))
+    return ' '.join(pieces)
 
 
 def build_menu(buttons,
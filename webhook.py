@@ -0,0 +1,139 @@
+"""Webhook mode, where Telegram POSTs updates to a small HTTP server instead of the bot polling for them
+
+Enabled by a [WEBHOOK] section in bot.ini:
+
+    [WEBHOOK]
+    url = https://example.com/rules-bot
+    secret = ...
+    listen = 127.0.0.1
+    port = 8443
+    queue_size = 256
+
+Telegram posts to url with the secret appended as last path segment. The secret is 1-256 characters out of
+A-Z, a-z, 0-9, _ and -. The others are optional, shown with their defaults. The server is meant to sit behind
+a reverse proxy terminating TLS and passing paths on unchanged. Requests must come to the path of url followed
+by /<secret>, /rules-bot/<secret> above, and carry the secret in the X-Telegram-Bot-Api-Secret-Token header, as
+Telegram does once the webhook is set. A body may hold a single update or a list of them, which is only taken
+if the queue has room for all of it.
+"""
+import hmac
+import json
+import logging
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from queue import Queue
+from urllib.parse import urlsplit
+
+from telegram import Update
+
+LISTEN = '127.0.0.1'
+PORT = 8443
+# Updates waiting for the dispatcher, past that Telegram is told to come back later
+QUEUE_SIZE = 256
+MAX_BODY_BYTES = 1024 * 1024
+# How long stopping waits for the dispatcher to take the updates that were accepted already
+DRAIN_TIMEOUT = 30
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    # Telegram keeps its connections open between updates
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        server = self.server
+        if not (hmac.compare_digest(self.path.encode(), server.path.encode())
+                and hmac.compare_digest(self.headers.get(SECRET_HEADER, '').encode(), server.secret.encode())):
+            self.close_connection = True
+            return self._respond(403)
+
+        try:
+            length = int(self.headers['Content-Length'])
+        except (TypeError, ValueError):
+            self.close_connection = True
+            return self._respond(411)
+        if length > MAX_BODY_BYTES:
+            self.close_connection = True
+            return self._respond(413)
+
+        try:
+            data = json.loads(self.rfile.read(length).decode())
+            updates = [Update.de_json(each, server.bot) for each in (data if isinstance(data, list) else [data])]
+        except Exception:
+            logger.warning('Could not read the updates posted to the webhook', exc_info=True)
+            return self._respond(400)
+
+        # Telegram sends the updates again after a failed request, so they're either all taken or none is
+        self._respond(200 if server.enqueue(updates) else 503)
+
+    def _respond(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class WebhookServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, bot, secret, path, update_queue):
+        super().__init__(address, WebhookHandler)
+        self.bot = bot
+        self.secret = secret
+        self.path = path
+        self.update_queue = update_queue
+        self._lock = threading.Lock()
+
+    def enqueue(self, updates):
+        """Queues all updates if there is room for all of them, returns whether it did"""
+        with self._lock:
+            # Only this lock's holder adds to the queue, so the room left can only grow while it's held
+            if self.update_queue.maxsize - self.update_queue.qsize() < len(updates):
+                logger.warning(f'Update queue full, turning away {len(updates)} updates')
+                return False
+            for update in updates:
+                self.update_queue.put_nowait(update)
+        return True
+
+    def shutdown(self):
+        """Stops taking updates, and waits for the dispatcher to take the ones queued already"""
+        super().shutdown()
+        self.server_close()
+        deadline = time.monotonic() + DRAIN_TIMEOUT
+        while not self.update_queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.1)
+
+
+def set_webhook(bot, url, secret):
+    # This version of ptb doesn't know about secret_token yet, so the request is made directly
+    bot.request.post(f'{bot.base_url}/setWebhook', {'url': url, 'secret_token': secret})
+
+
+def start_webhook(updater, config):
+    """Serves the webhook configured in config instead of polling, stopped by updater.stop() like polling is"""
+    section = config['WEBHOOK']
+    secret = section['secret']
+
+    # The dispatcher takes the updates from this queue, bounded so that a flood waits on Telegram's side
+    update_queue = Queue(section.getint('queue_size', QUEUE_SIZE))
+    updater.update_queue = updater.dispatcher.update_queue = update_queue
+
+    url = section['url'].rstrip('/') + '/' + secret
+    server = WebhookServer((section.get('listen', LISTEN), section.getint('port', PORT)), updater.bot, secret,
+                           urlsplit(url).path, update_queue)
+    # updater.stop() shuts its httpd down before stopping the dispatcher, which lets the queue drain
+    updater.httpd = server
+    updater.running = True
+    updater.job_queue.start()
+    threading.Thread(target=updater.dispatcher.start, name='dispatcher').start()
+    threading.Thread(target=server.serve_forever, name='webhook').start()
+
+    # Updates that arrived while the bot was down are delivered once the webhook is set, none are dropped
+    set_webhook(updater.bot, url, secret)
+    logger.info(f'Webhook listening on {server.server_address[0]}:{server.server_address[1]}')
+    return server